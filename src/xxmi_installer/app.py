@@ -6,12 +6,11 @@ import multiprocessing
 import traceback
 import re
 import os
-import time
 
-from typing import Union, Callable
+from typing import Union, Callable, ClassVar, TYPE_CHECKING
 from enum import Enum
 from dataclasses import dataclass
-from threading import Thread, current_thread, main_thread
+from threading import current_thread, main_thread
 from queue import Queue, Empty
 from pathlib import Path
 
@@ -19,11 +18,21 @@ import core.path_manager as Paths
 import core.event_manager as Events
 import core.config_manager as Config
 
-from core.package_manager import PackageManager
+from core.package_manager import PackageManager, InstallationTarget
+from core.instance_coordinator import InstanceCoordinator, get_broadcast_events
+from core.event_profiler import EventProfiler
+from core.event_recorder import EventRecorder, EventReplayer, load_recording
+from core.utils.file_writer import Durability
+from core.utils.task_executor import TaskExecutor, Priority
+from core.utils.coalescing import RateLimit
+from core.utils.shutdown import ShutdownCoordinator, StopHook
+from core.utils import process_tracker
 
 from core.packages.launcher_package import LauncherPackage
 
-from gui.windows.main.main_window import MainWindow
+# GUI stack is imported only when it's going to be used, headless mode must stay free of it
+if TYPE_CHECKING:
+    from gui.windows.main.main_window import MainWindow
 
 
 class Mode(Enum):
@@ -37,40 +46,43 @@ class Mode(Enum):
 @dataclass
 class ApplicationEvents:
 
-    @dataclass
+    @dataclass(slots=True)
     class ConfigUpdate:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class Ready:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class Busy:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class StatusUpdate:
         status: str
 
-    @dataclass
+    @dataclass(slots=True)
     class MoveWindow:
+        log_sample_rate: ClassVar[int] = 0
+        # Window position is read from pointer on handling, so skipped events lose nothing
+        coalesce: ClassVar[RateLimit] = RateLimit(hz=60)
         offset_x: int
         offset_y: int
 
-    @dataclass
+    @dataclass(slots=True)
     class Minimize:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class Maximize:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class Close:
         delay: int = 0
 
-    @dataclass
+    @dataclass(slots=True)
     class Update:
         no_install: bool = False
         force: bool = False
@@ -79,19 +91,19 @@ class ApplicationEvents:
         silent: bool = False
         no_thread: bool = False
 
-    @dataclass
+    @dataclass(slots=True)
     class CheckForUpdates:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class WaitForProcess:
         process_name: str
 
-    @dataclass
+    @dataclass(slots=True)
     class WaitForProcessExit:
         process_name: str
 
-    @dataclass
+    @dataclass(slots=True)
     class ShowMessage:
         modal: bool = False
         icon: str = 'info-icon.ico'
@@ -104,27 +116,27 @@ class ApplicationEvents:
         lock_master: bool = None
         screen_center: bool = None
 
-    @dataclass
+    @dataclass(slots=True)
     class ShowError(ShowMessage):
         icon: str = 'error-icon.ico'
         title: str = 'Error'
 
-    @dataclass
+    @dataclass(slots=True)
     class ShowWarning(ShowMessage):
         icon: str = 'warning-icon.ico'
         title: str = 'Warning'
 
-    @dataclass
+    @dataclass(slots=True)
     class ShowInfo(ShowMessage):
         icon: str = 'info-icon.ico'
         title: str = 'Info'
 
-    @dataclass
+    @dataclass(slots=True)
     class ShowDialogue(ShowMessage):
         confirm_text: str = 'Confirm'
         cancel_text: str = 'Cancel'
 
-    @dataclass
+    @dataclass(slots=True)
     class VerifyFileAccess:
         path: Path
         abs_path: bool = True
@@ -132,99 +144,294 @@ class ApplicationEvents:
         write: bool = False
         exe: bool = False
 
-    @dataclass
+    @dataclass(slots=True)
     class InstallLauncher:
         pass
 
 
-class Application:
-    def __init__(self, app_gui: MainWindow):
-        self.is_alive = True
+INSTANCES = {
+    r'.*(WW).*': 'WWMI',
+    r'.*(ZZZ).*': 'ZZMI',
+    r'.*(HSR).*': 'SRMI',
+    r'.*(GI).*': 'GIMI',
+}
+
+
+def parse_target(value: str) -> InstallationTarget:
+    # Target is either plain folder path or folder path prefixed with instance name, e.g. "WWMI=D:\XXMI Launcher"
+    instance, separator, installation_dir = value.partition('=')
+    if separator and instance in INSTANCES.values():
+        return InstallationTarget(installation_dir=installation_dir, instance=instance)
+    return InstallationTarget(installation_dir=value)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Installs and updates XXMI Launcher')
+    parser.add_argument('-m', '--mode', type=Mode, choices=list(Mode), default=Mode.Install, 
+                        help='Switch between "Installer" and "Updater" modes')
+    parser.add_argument('-d', '--dist_dir', type=str, default=Path.home() / 'AppData' / 'Roaming' / 'XXMI Launcher',
+                        help='Launcher installation directory')
+    parser.add_argument('-s', '--shortcut', type=bool, default=True, 
+                        help='Default state of "Create Desktop Shortcut" checkbox')
+    parser.add_argument('--durability', type=Durability, choices=list(Durability), default=Durability.Fast,
+                        help='Switch between "Fast" (deferred flush) and "Safe" (fsync every file) disk writes')
+    parser.add_argument('--headless', action='store_true',
+                        help='Install launcher without GUI, progress is reported to stdout')
+    parser.add_argument('--progress', type=str, choices=['console', 'jsonl'], default='console',
+                        help='Progress output format of headless mode')
+    parser.add_argument('-t', '--target', type=parse_target, action='append', default=None,
+                        help='Batch install to [INSTANCE=]FOLDER target, can be used multiple times, implies headless mode')
+    parser.add_argument('--batch_workers', type=int, default=2,
+                        help='Amount of batch targets processed at once')
+    parser.add_argument('--profile_events', type=Path, default=None,
+                        help='Measure time spent by event handlers and write the report to given JSON file on exit')
+    parser.add_argument('--record_events', type=Path, default=None,
+                        help='Write every fired event to given file, so the session can be replayed later')
+    parser.add_argument('--replay_events', type=Path, default=None,
+                        help='Replay recorded events in the installer window without running any installer tasks')
+    parser.add_argument('--replay_speed', type=float, default=1,
+                        help='Speed multiplier of replay, 0 fires recorded events as fast as possible')
+    return parser.parse_args()
+
+
+def get_instance():
+    exe_name = Path(sys.executable).name
+    for pattern, instance in INSTANCES.items():
+        if len(re.compile(pattern).findall(exe_name)):
+            return instance
+    return None
+
+
+def load_config(args, instance):
+    Config.Config.load()
+
+    Config.Launcher.installation_dir = str(args.dist_dir)
+    # Config.Launcher.create_shortcut = args.shortcut and args.mode != Mode.Update
+    Config.Launcher.instance = instance
+    Config.Packages.durability = str(args.durability)
+
+
+def start_event_profiling(args):
+    if args.profile_events is None:
+        return None
+    event_profiler = EventProfiler()
+    Events.StartProfiling(event_profiler)
+    return event_profiler
+
+
+def dump_event_profile(args, event_profiler):
+    if event_profiler is None:
+        return
+    try:
+        event_profiler.dump(args.profile_events)
+    except Exception as e:
+        logging.error(f'Failed to write event handling profile: {e}')
+
+
+def start_event_recording(args):
+    if args.record_events is not None:
+        Events.StartRecording(EventRecorder(args.record_events))
+
+
+def create_coordinator():
+    # Concurrent installer processes share single update of the same folder instead of racing over its files
+    coordinator = InstanceCoordinator([
+        Events.Application.Busy,
+        Events.Application.StatusUpdate,
+        Events.Application.WaitForProcess,
+        Events.Application.WaitForProcessExit,
+        *get_broadcast_events(Events.PackageManager, Events.LauncherManager),
+    ])
+    coordinator.subscribe()
+    return coordinator
+
+
+class HeadlessApplication:
+    def __init__(self, args):
+        self.args = args
+        self.instance = get_instance()
+        self.event_profiler = start_event_profiling(self.args)
+        start_event_recording(self.args)
+
+        load_config(self.args, self.instance)
+
+        if self.args.progress == 'jsonl':
+            from core.progress_sink import JsonLinesProgressSink
+            self.progress_sink = JsonLinesProgressSink()
+        else:
+            from core.progress_sink import ConsoleProgressSink
+            self.progress_sink = ConsoleProgressSink()
+        self.progress_sink.subscribe()
+
+        self.packages = [
+            LauncherPackage(skip_installed_version=self.args.mode == Mode.Update),
+        ]
+
+        self.package_manager = PackageManager(self.packages)
+
+        self.coordinator = create_coordinator()
+
+    def run(self) -> int:
+        try:
+            if self.args.target:
+                results = self.package_manager.batch_install('Launcher', self.args.target, max_workers=self.args.batch_workers)
+                return 1 if 'Failed' in results else 0
+            self.coordinator.run(Config.Launcher.installation_dir, self.package_manager.update_packages, force=True, reinstall=True, packages=['Launcher'])
+        except Exception as e:
+            logging.exception(e)
+            Events.Fire(Events.Application.ShowError(message=str(e)))
+            return 1
+        finally:
+            self.coordinator.cleanup()
+            Events.StopRecording()
+            dump_event_profile(self.args, self.event_profiler)
+        return 0
+
+
+class ReplayApplication:
+    """
+    Feeds recorded session into installer window, so GUI responsiveness can be measured without network or disk activity
+    """
+    def __init__(self, app_gui: 'MainWindow', args):
         self.gui = app_gui
-        self.instance = self.get_instance()
+        self.args = args
+        self.event_profiler = start_event_profiling(self.args)
+
+        load_config(self.args, get_instance())
 
-        parser = argparse.ArgumentParser(description='Installs and updates XXMI Launcher')
-        parser.add_argument('-m', '--mode', type=Mode, choices=list(Mode), default=Mode.Install, 
-                            help='Switch between "Installer" and "Updater" modes')
-        parser.add_argument('-d', '--dist_dir', type=str, default=Path.home() / 'AppData' / 'Roaming' / 'XXMI Launcher',
-                            help='Launcher installation directory')
-        parser.add_argument('-s', '--shortcut', type=bool, default=True, 
-                            help='Default state of "Create Desktop Shortcut" checkbox')
-        self.args = parser.parse_args()
+        # Recorded close would destroy window before the report and modal dialogs would wait for user input
+        self.replayer = EventReplayer(load_recording(self.args.replay_events), speed=self.args.replay_speed,
+                                      skip=lambda event: isinstance(event, Events.Application.Close) or
+                                      getattr(event, 'modal', False))
 
-        Config.Config.load()
+        # Events are delivered the same way as in real session, so coalescing is applied as well
+        Events.StartQueuedDelivery(lambda callback, delay: self.gui.after(delay, callback))
+        self.gui.after(0, Events.DeliverQueued)
 
-        Config.Launcher.installation_dir = str(self.args.dist_dir)
-        # Config.Launcher.create_shortcut = self.args.shortcut and self.args.mode != Mode.Update
-        Config.Launcher.instance = self.instance
+        self.gui.initialize()
+        Events.Fire(Events.Application.Ready())
+
+        self.replayer.start(self.gui, on_done=self.handle_replay_done)
+        self.gui.open()
+
+    def handle_replay_done(self, report: dict):
+        print(report)
+        dump_event_profile(self.args, self.event_profiler)
+        self.gui.close()
 
-        self.threads = []
+
+# Upper limit of time given to running tasks to stop on exit
+SHUTDOWN_TIMEOUT = 15
+
+
+class Application:
+    def __init__(self, app_gui: 'MainWindow', args):
+        self.gui = app_gui
+        self.instance = get_instance()
+        self.args = args
+        self.event_profiler = start_event_profiling(self.args)
+        start_event_recording(self.args)
+
+        load_config(self.args, self.instance)
+
+        # User-initiated update and background prefetch may run at the same time, but never more
+        self.executor = TaskExecutor(max_workers=2)
         self.error_queue = Queue()
 
         self.mode = self.args.mode
 
         self.packages = [
-            LauncherPackage(),
+            LauncherPackage(skip_installed_version=self.in_updater_mode()),
         ]
 
         self.package_manager = PackageManager(self.packages)
 
-        Events.Subscribe(Events.Application.InstallLauncher, lambda event: self.install_launcher())
+        self.shutdown = ShutdownCoordinator()
+        self.shutdown.register(StopHook(
+            name='Process Watcher',
+            stop=lambda deadline: process_tracker.watcher.stop(),
+            wait=process_tracker.watcher.join,
+        ))
+        self.shutdown.register(StopHook(
+            name='Tasks',
+            stop=lambda deadline: self.stop_tasks(),
+            wait=self.executor.join,
+            escalate=self.report_stuck_tasks,
+        ))
+        # Goes after tasks, as lock files of operations that are still running are kept
+        self.shutdown.register(StopHook(
+            name='Instance Coordinator',
+            stop=lambda deadline: None,
+            wait=lambda timeout: self.coordinator.cleanup(),
+        ))
 
-        self.gui.initialize()
+        # GUI callbacks of events fired by tasks are run by Tk main loop, so Tk is never touched from worker threads
+        Events.StartQueuedDelivery(self.schedule_on_gui)
 
-        if self.args.mode == Mode.Install:
-            Events.Fire(Events.Application.Ready())
-        elif self.args.mode == Mode.Update:
+        # Coordinator must subscribe before event buffering starts, so attached processes get events right away
+        self.coordinator = create_coordinator()
+
+        Events.Subscribe(Events.Application.InstallLauncher, lambda event: self.install_launcher())
+
+        if self.args.mode == Mode.Update:
+            # Start update right away, events fired before GUI is built are buffered and replayed to its widgets
+            Events.StartBuffering()
             self.install_launcher()
-            
-        self.check_threads()
+            try:
+                self.gui.initialize()
+            finally:
+                Events.ReplayBuffered()
+        else:
+            self.gui.initialize()
+            Events.Fire(Events.Application.Ready())
+            # Download the launcher in background while user is looking at the installer window
+            self.run_task(self.package_manager.prefetch_packages, packages=['Launcher'], priority=Priority.Background)
+
+        # Report errors and deliver events of tasks that were queued before main loop was able to accept calls from other threads
+        self.gui.after(0, self.report_thread_errors)
+        self.gui.after(0, Events.DeliverQueued)
 
         self.gui.open()
         
         self.exit()
 
     def install_launcher(self):
-        self.run_as_thread(self.package_manager.update_packages, force=True, reinstall=True, packages=['Launcher'])
+        self.run_task(self.run_update, priority=Priority.User)
+
+    def run_update(self):
+        # Installation folder may be changed by user, so it's resolved right before the update
+        if not self.coordinator.run(Config.Launcher.installation_dir, self.package_manager.update_packages, force=True, reinstall=True, packages=['Launcher']):
+            # Launcher was installed and started by another installer process
+            Events.Fire(Events.Application.Close(delay=500))
 
     def in_updater_mode(self):
         return self.mode == Mode.Update
 
-    def get_instance(self):
-        instances = {
-            r'.*(WW).*': 'WWMI',
-            r'.*(ZZZ).*': 'ZZMI',
-            r'.*(HSR).*': 'SRMI',
-            r'.*(GI).*': 'GIMI',
-        }
-        exe_name = Path(sys.executable).name
-        for pattern, instance in instances.items():
-            if len(re.compile(pattern).findall(exe_name)):
-                return instance
-        return None
-
-    def run_as_thread(self, callback, *args, **kwargs):
-        def wrap_errors(func, *func_args, **func_kwargs):
+    def run_task(self, callback, *args, priority: Priority = Priority.Background, **kwargs):
+        return self.executor.submit(callback, *args, priority=priority, on_done=self.handle_task_done, **kwargs)
+
+    def schedule_on_gui(self, callback, delay=0):
+        self.gui.after(delay, callback)
+
+    def handle_task_done(self, future):
+        # Called from worker thread, error is queued right away and only its display is marshalled to GUI
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        self.error_queue.put_nowait((error, ''.join(traceback.format_exception(type(error), error, error.__traceback__))))
+        # If delivery is already stopped, queued errors are reported on exit
+        Events.CallOnMainThread(self.report_thread_errors)
+
+    def report_thread_errors(self):
+        # Errors are shown only once main window is visible
+        if self.gui.state() != 'normal':
+            self.gui.after(50, self.report_thread_errors)
+            return
+        while True:
             try:
-                func(*func_args, **func_kwargs)
-            except Exception as e:
-                self.error_queue.put_nowait((e, traceback.format_exc()))
-        thread = Thread(target=wrap_errors, args=(callback, *args), kwargs=kwargs)
-        self.threads.append(thread)
-        thread.start()
-
-    def check_threads(self):
-        self.gui.after(50, self.check_threads)
-        # Remove finished threads from the list
-        self.threads = [thread for thread in self.threads if thread.is_alive()]
-        # Raise exceptions sent to error queue by threads
-        try:
-            if self.gui.state() != 'normal':
-                return
-            self.report_thread_error()
-            # raise exception
-        except Empty:
-            pass
+                self.report_thread_error()
+            except Empty:
+                break
 
     def report_thread_error(self):
         (error, trace) = self.error_queue.get_nowait()
@@ -239,39 +446,33 @@ class Application:
         if gui_open:
             self.gui.after(100, Events.Fire, Events.Application.Ready())
 
-    def watchdog(self, timeout: int = 15):
-        timeout = time.time() + timeout
-        while True:
-            time.sleep(0.1)
-            if not self.is_alive:
-                return
-            if time.time() > timeout:
-                break
-        logging.error('[WATCHDOG]: Shutting down stuck process...')
-        os._exit(os.EX_OK)
+    def stop_tasks(self):
+        # Stop running downloads at the next block, installation stages check for cancellation as well
+        self.package_manager.cancel()
+        self.executor.shutdown(wait=False)
+
+    def report_stuck_tasks(self):
+        for trace in self.executor.get_stuck_traces():
+            logging.error(f'Stuck task:\n{trace}')
 
     def exit(self):
         try:
             assert current_thread() is main_thread()
         except Exception as e:
             self.error_queue.put_nowait((e, traceback.format_exc()))
-        # Start watchdog to forcefully shutdown process in 15 seconds
-        watchdog_thread = Thread(target=self.watchdog, kwargs={'timeout': 15})
-        watchdog_thread.start()
-        # Join active threads
-        logging.debug(f'Joining threads...')
-        for thread in self.threads:
-            thread.join()
-        # Join watchdog thread
-        logging.debug(f'Joining watchdog thread...')
-        self.is_alive = False
-        watchdog_thread.join()
+        # Main loop is closed, so threads waiting for modal dialogs must be released
+        Events.StopQueuedDelivery()
+        # Stuck components are left behind, as process is going to be terminated right after
+        logging.debug(f'Stopping components...')
+        self.shutdown.shutdown(timeout=SHUTDOWN_TIMEOUT)
         # Report any errors left in queue
         while True:
             try:
                 self.report_thread_error()
             except Empty:
                 break
+        Events.StopRecording()
+        dump_event_profile(self.args, self.event_profiler)
         logging.debug(f'App Exit')
         os._exit(os.EX_OK)
         
@@ -295,10 +496,21 @@ if __name__ == '__main__':
 
     logging.debug(f'App Start')
 
+    app_args = parse_args()
+
+    if app_args.headless or app_args.target:
+        sys.exit(HeadlessApplication(app_args).run())
+
+    from gui.windows.main.main_window import MainWindow
+
+    if app_args.replay_events:
+        ReplayApplication(MainWindow(), app_args)
+        sys.exit(0)
+
     try:
         # raise ValueError('1\n2\n3')
         gui = MainWindow()
-        Application(gui)
+        Application(gui, app_args)
     except Exception as e:
         logging.exception(e)
         MainWindow().show_messagebox(Events.Application.ShowError(
@@ -1,9 +1,13 @@
+import time
 import logging
+import itertools
+
+from collections import deque
+from threading import RLock, Lock, Event, main_thread, get_ident
 
 import app
 import core.package_manager as package_manager
 from core.packages import launcher_package as launcher_package
-from gui import events as gui_events
 
 log = logging.getLogger(__name__)
 
@@ -11,58 +15,407 @@ log = logging.getLogger(__name__)
 Application = app.ApplicationEvents
 LauncherManager = launcher_package.LauncherManagerEvents
 PackageManager = package_manager.PackageManagerEvents
-GUI = gui_events.GUIEvents
 
 events = {}
 
+# Subscriptions indexed by id of their caller, so all of them are removed without scanning every event
+caller_index = {}
+callback_index = {}
+callback_counter = itertools.count()
+registry_lock = Lock()
+
+# Precompiled callbacks of every event, tuples are dropped when subscriptions change and rebuilt on next fire
+dispatch_table = {}
+
+log_counters = {}
+
+# Callbacks are wrapped with timing code only while profiling is active, so it costs nothing otherwise
+profiler = None
+
+# Every fired event is passed to recorder while recording is active
+recorder = None
+
+# Events fired off the main thread are queued for callbacks that aren't thread safe
+# Queue is drained in batches by delivery loop that main thread runs itself, so other threads never touch Tk
+main_thread_id = main_thread().ident
+delivery_lock = Lock()
+delivery_queue = None
+delivery_schedule = None
+delivery_active = False
+
+# Time budget of single batch delivery, so main loop has time left to process user input and redraw
+DELIVERY_BUDGET = 0.008
+# Interval of delivery loop
+DELIVERY_INTERVAL = 16
+
+# Latest pending event of every class with coalesce policy and its due time, delivery loop sends it once it's due
+coalesce_lock = Lock()
+coalesce_pending = {}
+coalesce_last_delivery = {}
+
+# Events fired while buffering is active are recorded for callbacks subscribed during buffering
+buffer_lock = RLock()
+buffered_events = None
+buffered_callback_ids = set()
+
+
+def __getattr__(name):
+    # GUI events are resolved on first access, so headless mode never imports gui package
+    if name == 'GUI':
+        from gui import events as gui_events
+        return gui_events.GUIEvents
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 def Call(event_data, **kw):
-    log.debug(f'Called: {str(event_data)}')
-    callbacks = events.get(event_data.__class__.__qualname__, None)
-    if callbacks is not None:
-        if len(callbacks) == 1:
-            (event, callback, caller_id) = list(callbacks.values())[0]
-            return callback(event_data, **kw)
-        else:
-            raise ValueError(f'Failed to call {str(event_data)}: 1 callback expected, {len(callbacks)} found!')
-    else:
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Called: %s', event_data)
+    callbacks = _get_callbacks(event_data.__class__.__qualname__)
+    if len(callbacks) == 1:
+        callback_id, callback, thread_safe = callbacks[0]
+        return callback(event_data, **kw)
+    elif len(callbacks) == 0:
         raise ValueError(f'Failed to call {str(event_data)}: no callbacks found!')
+    else:
+        raise ValueError(f'Failed to call {str(event_data)}: 1 callback expected, {len(callbacks)} found!')
 
 
 def Fire(event_data, **kw):
-    if not event_data.__class__ == Application.MoveWindow:
-        log.debug(f'FIRED: {str(event_data)}')
-    callbacks = events.get(event_data.__class__.__qualname__, None)
-    if callbacks is not None:
-        for (event, callback, caller_id) in list(callbacks.values()):
+    if log.isEnabledFor(logging.DEBUG):
+        _log_fired(event_data)
+    if recorder is not None:
+        recorder.record(event_data, kw)
+    # High-rate events declare coalesce policy, it's enforced only while delivery loop is running
+    policy = getattr(event_data.__class__, 'coalesce', None)
+    if policy is not None and delivery_active:
+        if _coalesce(policy, event_data, kw):
+            return
+    elif coalesce_pending:
+        # Pending coalesced events must be delivered before any event fired after them
+        _flush_coalesced()
+    _dispatch(event_data, **kw)
+
+
+def _dispatch(event_data, **kw):
+    if buffered_events is not None:
+        with buffer_lock:
+            handled = _fire_buffered(event_data, **kw)
+        if handled is not None:
+            handled.wait()
+        return
+    if delivery_queue is not None and get_ident() != main_thread_id:
+        _fire_queued(event_data, **kw)
+        return
+    for callback_id, callback, thread_safe in _get_callbacks(event_data.__class__.__qualname__):
+        callback(event_data, **kw)
+
+
+def _coalesce(policy, event_data, kw) -> bool:
+    event_class = event_data.__class__
+    now = time.perf_counter()
+    with coalesce_lock:
+        pending = coalesce_pending.get(event_class, None)
+        if pending is not None:
+            # Pending event is replaced, its due time is kept
+            coalesce_pending[event_class] = (pending[0], event_data, kw)
+            return True
+        delay = policy.get_delay(now, coalesce_last_delivery.get(event_class, float('-inf')))
+        if delay <= 0:
+            coalesce_last_delivery[event_class] = now
+            return False
+        coalesce_pending[event_class] = (now + delay, event_data, kw)
+    return True
+
+
+def _flush_coalesced(now=None):
+    """
+    Dispatches pending coalesced events, only ones that are due if now is provided
+    """
+    with coalesce_lock:
+        flushed = []
+        for event_class, (due_time, event_data, kw) in list(coalesce_pending.items()):
+            if now is not None and due_time > now:
+                continue
+            del coalesce_pending[event_class]
+            coalesce_last_delivery[event_class] = time.perf_counter()
+            flushed.append((event_data, kw))
+    for event_data, kw in flushed:
+        _dispatch(event_data, **kw)
+
+
+def _fire_queued(event_data, **kw):
+    queued = False
+    for callback_id, callback, thread_safe in _get_callbacks(event_data.__class__.__qualname__):
+        if thread_safe:
             callback(event_data, **kw)
+        else:
+            queued = True
+    if not queued:
+        return
+    # Modal events block the thread that fired them until they're handled, as it may depend on user response
+    handled = Event() if getattr(event_data, 'modal', False) else None
+    with delivery_lock:
+        if delivery_queue is None:
+            # Delivery is stopped, so there's no main loop to wait for
+            _deliver_event(event_data, kw)
+            return
+        delivery_queue.append((_deliver_event, (event_data, kw), handled))
+    if handled is not None:
+        handled.wait()
+
+
+def _deliver_event(event_data, kw):
+    for callback_id, callback, thread_safe in _get_callbacks(event_data.__class__.__qualname__):
+        if thread_safe:
+            continue
+        try:
+            callback(event_data, **kw)
+        except Exception as e:
+            log.exception(f'Failed to handle {event_data.__class__.__qualname__}: {e}')
+
+
+def CallOnMainThread(callback, *args) -> bool:
+    """
+    Queues callback to be called by delivery loop, returns False if delivery isn't active
+    """
+    with delivery_lock:
+        if delivery_queue is None:
+            return False
+        delivery_queue.append((callback, args, None))
+    return True
+
+
+def StartQueuedDelivery(schedule):
+    """
+    Makes events fired off the main thread to be delivered on the main thread
+    Provided schedule(callback, delay_ms) function must run the callback on the main thread, e.g. via Tk after()
+    It's called only from the main thread, events are queued until DeliverQueued starts the delivery loop
+    Callbacks subscribed as thread safe are still called right away from the thread that fired the event
+    """
+    global delivery_queue, delivery_schedule
+    delivery_schedule = schedule
+    delivery_queue = deque()
+
+
+def StopQueuedDelivery():
+    """
+    Stops delivery loop and releases threads waiting for their modal events, undelivered events are dropped
+    """
+    global delivery_queue, delivery_active
+    with delivery_lock:
+        queue, delivery_queue = delivery_queue, None
+        delivery_active = False
+    while queue:
+        function, args, handled = queue.popleft()
+        if handled is not None:
+            handled.set()
 
 
-def Subscribe(event, callback, caller_id=None):
+def DeliverQueued():
+    """
+    Starts delivery loop, must be called from the main loop, e.g. via Tk after()
+    """
+    global delivery_active
+    if delivery_active or delivery_queue is None:
+        return
+    delivery_active = True
+    _deliver_queued()
+
+
+def _deliver_queued():
+    global delivery_active
+    queue = delivery_queue
+    if queue is None:
+        return
+    deadline = time.perf_counter() + DELIVERY_BUDGET
+    try:
+        while queue and time.perf_counter() < deadline:
+            function, args, handled = queue.popleft()
+            try:
+                function(*args)
+            except Exception as e:
+                log.exception(f'Failed to call {function}: {e}')
+            finally:
+                if handled is not None:
+                    handled.set()
+        # Coalesced events go after every event that was queued before them
+        if not queue and coalesce_pending:
+            _flush_coalesced(time.perf_counter())
+    finally:
+        if delivery_active:
+            try:
+                # Queue that wasn't drained within time budget is continued right after pending redraws
+                delivery_schedule(_deliver_queued, 0 if queue else DELIVERY_INTERVAL)
+            except Exception:
+                # Main loop is closed
+                delivery_active = False
+
+
+def _log_fired(event_data):
+    # High-rate events declare log_sample_rate to get only every Nth of them logged, 0 disables logging
+    event_class = event_data.__class__
+    sample_rate = getattr(event_class, 'log_sample_rate', 1)
+    if sample_rate == 0:
+        return
+    if sample_rate > 1:
+        count = log_counters.get(event_class, 0)
+        log_counters[event_class] = count + 1
+        if count % sample_rate != 0:
+            return
+    log.debug('FIRED: %s', event_data)
+
+
+def _fire_buffered(event_data, **kw):
+    buffering = buffered_events is not None
+    handled = None
+    if buffering:
+        # Modal event fired off the main thread blocks the thread until it's replayed
+        if getattr(event_data, 'modal', False) and get_ident() != main_thread_id:
+            handled = Event()
+        buffered_events.append((event_data, kw, handled))
+    for callback_id, callback, thread_safe in _get_callbacks(event_data.__class__.__qualname__):
+        if buffering and callback_id in buffered_callback_ids:
+            continue
+        callback(event_data, **kw)
+    return handled
+
+
+def StartBuffering():
+    """
+    Defers delivery of fired events to callbacks subscribed from now on until ReplayBuffered call
+    Existing callbacks keep receiving events as usual
+    """
+    global buffered_events
+    with buffer_lock:
+        buffered_events = []
+        buffered_callback_ids.clear()
+
+
+def ReplayBuffered():
+    global buffered_events
+    with buffer_lock:
+        if buffered_events is None:
+            return
+        # Events fired by callbacks during replay are appended to the same list and replayed in order as well
+        index = 0
+        while index < len(buffered_events):
+            event_data, kw, handled = buffered_events[index]
+            index += 1
+            try:
+                for callback_id, callback, thread_safe in _get_callbacks(event_data.__class__.__qualname__):
+                    if callback_id in buffered_callback_ids:
+                        callback(event_data, **kw)
+            finally:
+                if handled is not None:
+                    handled.set()
+        buffered_events = None
+        buffered_callback_ids.clear()
+
+
+def _get_callbacks(event_name):
+    callbacks = dispatch_table.get(event_name, None)
+    if callbacks is None:
+        with registry_lock:
+            callbacks = tuple((callback_id, callback if profiler is None else _profile(event_name, callback, profiler), thread_safe)
+                              for callback_id, (event, callback, caller_id, thread_safe) in events.get(event_name, {}).items())
+            dispatch_table[event_name] = callbacks
+    return callbacks
+
+
+def _profile(event_name, callback, event_profiler):
+    subscriber = f'{getattr(callback, "__module__", None)}.{getattr(callback, "__qualname__", repr(callback))}'
+
+    def profiled_callback(event_data, **kw):
+        start = time.perf_counter()
+        try:
+            return callback(event_data, **kw)
+        finally:
+            event_profiler.record(event_name, subscriber, time.perf_counter() - start)
+
+    return profiled_callback
+
+
+def StartProfiling(event_profiler):
+    """
+    Makes every callback call to be timed and recorded by provided EventProfiler
+    """
+    global profiler
+    with registry_lock:
+        profiler = event_profiler
+        dispatch_table.clear()
+
+
+def StopProfiling():
+    global profiler
+    with registry_lock:
+        profiler = None
+        dispatch_table.clear()
+
+
+def StartRecording(event_recorder):
+    global recorder
+    recorder = event_recorder
+
+
+def StopRecording():
+    global recorder
+    event_recorder, recorder = recorder, None
+    if event_recorder is not None:
+        event_recorder.close()
+
+
+def Subscribe(event, callback, caller_id=None, thread_safe=False):
     event_name = event.__qualname__
-    if event_name not in events:
-        events[event_name] = {}
-    callback_id = f'{event_name}_{len(events[event_name])}'
-    events[event_name][callback_id] = (event, callback, caller_id)
+    with registry_lock:
+        # Ids are never reused, so callback_id of removed subscription can't match another one
+        callback_id = f'{event_name}_{next(callback_counter)}'
+        events.setdefault(event_name, {})[callback_id] = (event, callback, caller_id, thread_safe)
+        callback_index[callback_id] = event_name
+        if caller_id is not None:
+            caller_index.setdefault(id(caller_id), {})[callback_id] = None
+        if buffered_events is not None:
+            buffered_callback_ids.add(callback_id)
+        dispatch_table.pop(event_name, None)
     return callback_id
 
 
 def Unsubscribe(callback_id=None, event=None, callback=None, caller_id=None):
-    if event is not None:
-        callbacks = events.get(event.__qualname__, None)
-        if callbacks is not None:
-            _unsubscribe(callbacks, callback_id=callback_id, callback=callback, caller_id=caller_id)
-    else:
-        for callbacks in list(events.values()):
-            _unsubscribe(callbacks, callback_id=callback_id, callback=callback, caller_id=caller_id)
+    with registry_lock:
+        # Narrow down candidates using the most specific index available
+        if callback_id is not None:
+            callback_ids = [callback_id] if callback_id in callback_index else []
+        elif caller_id is not None:
+            callback_ids = list(caller_index.get(id(caller_id), ()))
+        elif event is not None:
+            callback_ids = list(events.get(event.__qualname__, ()))
+        else:
+            callback_ids = list(callback_index.keys())
 
+        event_names = set()
+        for del_callback_id in callback_ids:
+            event_name = callback_index[del_callback_id]
+            if event is not None and event.__qualname__ != event_name:
+                continue
+            (del_event, del_callback, del_caller_id, del_thread_safe) = events[event_name][del_callback_id]
+            if callback is not None and callback != del_callback:
+                continue
+            if caller_id is not None and caller_id is not del_caller_id:
+                continue
+            _remove(event_name, del_callback_id, del_caller_id)
+            event_names.add(event_name)
 
-def _unsubscribe(callbacks, callback_id=None, callback=None, caller_id=None):
-    for del_callback_id, (event, del_callback, del_caller_id) in list(callbacks.items()):
-        if callback_id is not None and callback_id != del_callback_id:
-            continue
-        if callback is not None and callback != del_callback:
-            continue
-        if caller_id is not None and caller_id != del_caller_id:
-            continue
-        del callbacks[del_callback_id]
+        for event_name in event_names:
+            dispatch_table.pop(event_name, None)
+
+
+def _remove(event_name, callback_id, caller_id):
+    callbacks = events[event_name]
+    del callbacks[callback_id]
+    if not callbacks:
+        del events[event_name]
+    del callback_index[callback_id]
+    if caller_id is not None:
+        caller_callbacks = caller_index[id(caller_id)]
+        del caller_callbacks[callback_id]
+        if not caller_callbacks:
+            del caller_index[id(caller_id)]
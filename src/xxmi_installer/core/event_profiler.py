@@ -0,0 +1,75 @@
+import json
+import bisect
+import logging
+
+from dataclasses import dataclass, field, asdict
+from threading import Lock
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from core.utils.file_writer import FileWriter, Durability
+
+log = logging.getLogger(__name__)
+
+
+# Upper bounds of latency histogram buckets in milliseconds, the last bucket counts everything above
+HISTOGRAM_BOUNDS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+@dataclass
+class HandlerStats:
+    calls: int = 0
+    slow_calls: int = 0
+    total_ms: float = 0
+    max_ms: float = 0
+    histogram: List[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BOUNDS) + 1))
+
+    def add(self, duration_ms: float, slow: bool):
+        self.calls += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, duration_ms)] += 1
+        if slow:
+            self.slow_calls += 1
+
+
+class EventProfiler:
+    """
+    Collects call counts and latency histograms of every (event, subscriber) pair
+    Calls that take longer than threshold are logged as warnings, so heavy GUI handlers are easy to spot
+    """
+    def __init__(self, slow_threshold_ms: float = 16):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.stats: Dict[Tuple[str, str], HandlerStats] = {}
+        self.lock = Lock()
+
+    def record(self, event_name: str, subscriber: str, duration: float):
+        duration_ms = duration * 1000
+        slow = duration_ms > self.slow_threshold_ms
+        with self.lock:
+            stats = self.stats.get((event_name, subscriber), None)
+            if stats is None:
+                stats = self.stats[(event_name, subscriber)] = HandlerStats()
+            stats.add(duration_ms, slow)
+        if slow:
+            log.warning(f'Slow handler {subscriber} of {event_name}: {duration_ms:.1f}ms')
+
+    def snapshot(self) -> List[dict]:
+        """
+        Returns stats of every handler sorted by total time spent, the slowest ones go first
+        """
+        with self.lock:
+            snapshot = [{'event': event_name, 'subscriber': subscriber, **asdict(stats)}
+                        for (event_name, subscriber), stats in self.stats.items()]
+        for stats in snapshot:
+            stats['avg_ms'] = stats['total_ms'] / stats['calls']
+        snapshot.sort(key=lambda stats: stats['total_ms'], reverse=True)
+        return snapshot
+
+    def dump(self, path: Path):
+        FileWriter(Durability.Fast).write_text(path, json.dumps({
+            'slow_threshold_ms': self.slow_threshold_ms,
+            'histogram_bounds_ms': HISTOGRAM_BOUNDS,
+            'handlers': self.snapshot(),
+        }, indent=2), atomic=True)
+        log.debug(f'Event handling profile is written to {path}')
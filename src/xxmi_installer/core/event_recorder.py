@@ -0,0 +1,133 @@
+import gzip
+import time
+import pickle
+import logging
+
+from dataclasses import fields, replace
+from threading import Lock
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import core.event_manager as Events
+
+log = logging.getLogger(__name__)
+
+
+class EventRecorder:
+    """
+    Writes every fired event with its time offset to gzipped stream of pickled records
+    Callables carried by events (e.g. message box commands) can't be serialized, so they're recorded as None
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = gzip.open(path, 'wb')
+        self.lock = Lock()
+        self.start_time = time.perf_counter()
+
+    def record(self, event_data, kw):
+        offset = time.perf_counter() - self.start_time
+        try:
+            data = pickle.dumps((offset, event_data, kw), pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            event_data = replace(event_data, **{field.name: None for field in fields(event_data)
+                                                if callable(getattr(event_data, field.name))})
+            data = pickle.dumps((offset, event_data, kw), pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if self.file is not None:
+                self.file.write(data)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_recording(path: Path) -> List[tuple]:
+    """
+    Loads records of EventRecorder, file is unpickled, so it must come from trusted source
+    """
+    records = []
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except EOFError:
+                return records
+
+
+class EventReplayer:
+    """
+    Fires recorded events on Tk main loop at recorded pace multiplied by speed, speed 0 fires them as fast as possible
+    Main loop is probed every frame while replaying, so delays caused by event handlers show up as long frames
+    Events matched by skip are not fired (e.g. ones that close the window or block replay), but counted in report
+    """
+    def __init__(self, records: List[tuple], speed: float = 1, frame_interval: int = 16, budget: float = 0.008,
+                 skip: Optional[Callable[[object], bool]] = None):
+        self.records = records
+        self.skip = skip
+        self.skipped: Dict[str, int] = {}
+        self.speed = speed
+        self.frame_interval = frame_interval
+        self.budget = budget
+        self.index = 0
+        self.start_time = 0
+        self.frame_time = 0
+        self.frame_times: List[float] = []
+        self.on_done: Optional[Callable] = None
+        self.gui = None
+
+    def start(self, gui, on_done: Optional[Callable] = None):
+        self.gui = gui
+        self.on_done = on_done
+        self.start_time = self.frame_time = time.perf_counter()
+        self.gui.after(self.frame_interval, self.probe_frame)
+        self.gui.after(0, self.fire_due)
+
+    def fire_due(self):
+        now = time.perf_counter()
+        deadline = now + self.budget
+        while self.index < len(self.records):
+            offset, event_data, kw = self.records[self.index]
+            if self.speed > 0 and self.start_time + offset / self.speed > now:
+                delay = self.start_time + offset / self.speed - now
+                self.gui.after(int(delay * 1000), self.fire_due)
+                return
+            self.index += 1
+            if self.skip is not None and self.skip(event_data):
+                event_name = type(event_data).__qualname__
+                self.skipped[event_name] = self.skipped.get(event_name, 0) + 1
+            else:
+                Events.Fire(event_data, **kw)
+            now = time.perf_counter()
+            if now > deadline:
+                self.gui.after(0, self.fire_due)
+                return
+        # Let the last batch of events to get rendered before stopping the frame probe
+        self.gui.after(self.frame_interval, self.finish)
+
+    def probe_frame(self):
+        now = time.perf_counter()
+        self.frame_times.append((now - self.frame_time) * 1000)
+        self.frame_time = now
+        if self.on_done is not None:
+            self.gui.after(self.frame_interval, self.probe_frame)
+
+    def finish(self):
+        report = self.get_report()
+        log.info(f'Replay finished: {report}')
+        on_done, self.on_done = self.on_done, None
+        if on_done is not None:
+            on_done(report)
+
+    def get_report(self) -> dict:
+        frame_times = sorted(self.frame_times) or [0]
+        return {
+            'events': self.index - sum(self.skipped.values()),
+            'skipped': self.skipped,
+            'duration_ms': (time.perf_counter() - self.start_time) * 1000,
+            'frames': len(self.frame_times),
+            'frame_avg_ms': sum(frame_times) / len(frame_times),
+            'frame_p95_ms': frame_times[int(len(frame_times) * 0.95)],
+            'frame_max_ms': frame_times[-1],
+        }
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import secrets
+import tempfile
+
+from enum import Enum
+from dataclasses import dataclass, is_dataclass, fields, asdict
+from pathlib import Path
+from threading import Thread, Lock, Event, local
+from typing import Dict, List, Optional, Set, get_type_hints, get_origin, get_args
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection
+
+import core.event_manager as Events
+
+from core.utils.file_writer import FileWriter, Durability
+
+log = logging.getLogger(__name__)
+
+
+# Owner sends heartbeat while operation is silent, so follower can tell slow operation from hung owner
+HEARTBEAT_INTERVAL = 5
+FOLLOW_TIMEOUT = 30
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+@dataclass
+class OperationFinished:
+    error: str = ''
+
+
+def encode_value(value):
+    if is_dataclass(value):
+        return asdict(value)
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+def decode_value(hint, value):
+    if is_dataclass(hint) and isinstance(value, dict):
+        return hint(**{name: decode_value(field_hint, value[name])
+                       for name, field_hint in get_type_hints(hint).items() if name in value})
+    if isinstance(hint, type) and issubclass(hint, (Enum, Path)):
+        return hint(value)
+    if get_origin(hint) is dict and isinstance(value, dict):
+        key_hint, value_hint = get_args(hint)
+        return {key: decode_value(value_hint, item) for key, item in value.items()}
+    return value
+
+
+class InstanceLock:
+    """
+    Cross-process exclusive lock backed by locked file, it's released by OS if owner process dies
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+
+    def acquire(self) -> bool:
+        file = open(self.path, 'a+b')
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # Lock file could be removed by previous owner after it was opened, such lock guards nothing
+                if os.fstat(file.fileno()).st_ino != os.stat(self.path).st_ino:
+                    raise FileNotFoundError(self.path)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        return True
+
+    def release(self, remove: bool = False):
+        if self.file is None:
+            return
+        try:
+            if remove and sys.platform != 'win32':
+                # File is removed while it's still locked, processes that opened it already will retry with new one
+                self.path.unlink(missing_ok=True)
+            if sys.platform == 'win32':
+                import msvcrt
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
+        if remove and sys.platform == 'win32':
+            # Open file can't be removed on Windows, so removal fails if another process is waiting for the lock
+            try:
+                self.path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+
+class InstanceCoordinator:
+    """
+    Lets concurrent installer processes share single operation on the same installation folder
+    Process that holds the lock broadcasts its events over local connection, other processes attach and mirror them
+    """
+    def __init__(self, events: List[type]):
+        self.events = events
+        # Only known events are rebuilt from received messages
+        self.event_classes: Dict[str, type] = {event.__qualname__: event for event in events}
+        self.lock_paths: Set[Path] = set()
+        self.heartbeat_stop: Optional[Event] = None
+        self.run_lock = Lock()
+        self.address_path: Optional[Path] = None
+        self.listener: Optional[Listener] = None
+        self.connections: List[Connection] = []
+        self.connections_lock = Lock()
+        # Marks thread that re-fires mirrored events, they must never be sent back to the bus of another process
+        self.mirroring = local()
+
+    def subscribe(self):
+        # Events are broadcast only while this process owns an operation, so subscription is kept for the whole run
+        for event in self.events:
+            Events.Subscribe(event, self.broadcast_event, caller_id=self, thread_safe=True)
+
+    def unsubscribe(self):
+        Events.Unsubscribe(caller_id=self)
+
+    def run(self, installation_dir: str, callback, *args, **kwargs) -> bool:
+        """
+        Runs callback unless the same operation is already in process, returns False if it was run by another process
+        """
+        # File lock can't tell threads of the same process apart, so this process would follow itself otherwise
+        if not self.run_lock.acquire(blocking=False):
+            log.debug(f'Operation is already running in this process')
+            return True
+        try:
+            key = hashlib.sha1(str(Path(installation_dir).absolute()).lower().encode()).hexdigest()[:12]
+            lock = InstanceLock(Path(tempfile.gettempdir()) / f'XXMI-Installer-{key}.lock')
+            address_path = Path(tempfile.gettempdir()) / f'XXMI-Installer-{key}.json'
+            self.lock_paths.add(lock.path)
+            while not lock.acquire():
+                if self.follow(address_path):
+                    return False
+                # Owner process is gone before completion, so we're going to take over
+                time.sleep(0.1)
+            try:
+                self.start_broadcast(address_path)
+                result = OperationFinished()
+                try:
+                    callback(*args, **kwargs)
+                except Exception as e:
+                    result.error = str(e)
+                    raise
+                finally:
+                    self.broadcast(asdict(result) | {'finished': True})
+                    self.stop_broadcast()
+            finally:
+                lock.release(remove=True)
+            return True
+        finally:
+            self.run_lock.release()
+
+    def follow(self, address_path: Path, timeout: float = 5) -> bool:
+        """
+        Mirrors events of operation in process, returns True if it was completed successfully
+        """
+        connection = self.connect(address_path, timeout)
+        if connection is None:
+            return False
+        log.debug(f'Attached to operation of another installer process')
+        with connection:
+            while True:
+                try:
+                    # Owner that holds the lock but sends nothing, not even heartbeats, is hung
+                    if not connection.poll(FOLLOW_TIMEOUT):
+                        break
+                    message = json.loads(connection.recv_bytes(MAX_MESSAGE_SIZE))
+                except (EOFError, OSError, ValueError):
+                    return False
+                if not isinstance(message, dict):
+                    continue
+                if message.get('finished', False):
+                    if message.get('error', ''):
+                        raise ValueError(message['error'])
+                    return True
+                event = self.decode_event(message)
+                if event is None:
+                    continue
+                self.mirroring.active = True
+                try:
+                    Events.Fire(event)
+                finally:
+                    self.mirroring.active = False
+        raise ValueError('Another installer process is not responding!\n\n'
+                         'Please close it and try again.')
+
+    def connect(self, address_path: Path, timeout: float) -> Optional[Connection]:
+        # Owner writes its address right after taking the lock, so it may be not available yet
+        timeout = time.time() + timeout
+        while time.time() < timeout:
+            try:
+                address = json.loads(address_path.read_text())
+                return Client(('127.0.0.1', address['port']), authkey=bytes.fromhex(address['authkey']))
+            except (OSError, ValueError, KeyError, AuthenticationError):
+                # Address file may be left by crashed owner, so its port or authkey doesn't match anymore
+                time.sleep(0.1)
+        return None
+
+    def encode_event(self, event) -> dict:
+        return {
+            'event': event.__class__.__qualname__,
+            'data': {field.name: getattr(event, field.name) for field in fields(event)},
+        }
+
+    def decode_event(self, message: dict):
+        event_class = self.event_classes.get(message.get('event', None), None)
+        if event_class is None:
+            return None
+        try:
+            hints = get_type_hints(event_class)
+            return event_class(**{name: decode_value(hints.get(name, None), value)
+                                  for name, value in message.get('data', {}).items()})
+        except Exception as e:
+            log.debug(f'Failed to decode mirrored event {message.get("event")}: {e}')
+            return None
+
+    def start_broadcast(self, address_path: Path):
+        authkey = secrets.token_bytes(32)
+        self.listener = Listener(('127.0.0.1', 0), authkey=authkey)
+        self.address_path = address_path
+        FileWriter(Durability.Fast).write_text(address_path, json.dumps({
+            'pid': os.getpid(),
+            'port': self.listener.address[1],
+            'authkey': authkey.hex(),
+        }), atomic=True)
+        Thread(target=self.accept_connections, args=(self.listener,), daemon=True).start()
+        self.heartbeat_stop = Event()
+        Thread(target=self.send_heartbeats, args=(self.heartbeat_stop,), daemon=True).start()
+
+    def send_heartbeats(self, stop: Event):
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            self.broadcast({'heartbeat': True})
+
+    def stop_broadcast(self):
+        self.heartbeat_stop.set()
+        self.heartbeat_stop = None
+        self.address_path.unlink(missing_ok=True)
+        self.address_path = None
+        self.listener.close()
+        self.listener = None
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+    def accept_connections(self, listener: Listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception:
+                # Listener is closed or client failed authentication
+                if self.listener is not listener:
+                    return
+                continue
+            with self.connections_lock:
+                self.connections.append(connection)
+
+    def broadcast_event(self, event):
+        if self.listener is None or getattr(self.mirroring, 'active', False):
+            return
+        self.broadcast(self.encode_event(event))
+
+    def broadcast(self, message: dict):
+        # Messages are sent as JSON, so follower never unpickles data from endpoint it found in temp folder
+        data = json.dumps(message, default=encode_value).encode()
+        with self.connections_lock:
+            for connection in list(self.connections):
+                try:
+                    connection.send_bytes(data)
+                except Exception as e:
+                    log.debug(f'Detached installer process: {e}')
+                    connection.close()
+                    self.connections.remove(connection)
+
+
+    def cleanup(self, timeout: float = 0) -> bool:
+        """
+        Removes temp files of operations run by this process, files of operations that are still running are kept
+        """
+        if self.address_path is not None and self.run_lock.acquire(blocking=False):
+            # Operation thread is gone without reaching its finally block
+            try:
+                self.address_path.unlink(missing_ok=True)
+            finally:
+                self.run_lock.release()
+        for lock_path in list(self.lock_paths):
+            lock = InstanceLock(lock_path)
+            try:
+                if lock.acquire():
+                    lock.release(remove=True)
+            except OSError:
+                pass
+        return True
+
+
+def get_broadcast_events(*event_groups) -> List[type]:
+    events = []
+    for event_group in event_groups:
+        for event in vars(event_group).values():
+            if isinstance(event, type) and is_dataclass(event):
+                events.append(event)
+    return events
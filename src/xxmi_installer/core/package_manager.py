@@ -5,12 +5,14 @@ import re
 import zipfile
 import os
 import json
+import tempfile
 
 from dataclasses import dataclass, field, asdict
-from typing import Union, List, Dict, Optional
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Dict, Optional, Iterable, ClassVar
 from pathlib import Path
 from dacite import from_dict
-from win32api import GetFileVersionInfo, HIWORD, LOWORD
 
 import core.event_manager as Events
 import core.path_manager as Paths
@@ -18,9 +20,24 @@ import core.config_manager as Config
 
 from core.utils.security import Security
 from core.utils.github_client import GitHubClient
+from core.utils.file_writer import FileWriter, Durability
+from core.utils import pe_version
+from core.utils.pipeline import Pipeline
+from core.utils.dependency_graph import DependencyGraph
+from core.utils.cancellation import CancellationToken
+from core.utils.coalescing import RateLimit
 
 log = logging.getLogger(__name__)
 
+# Limits amount of packages processed in parallel during version detection and update checks
+MAX_CHECK_WORKERS = 4
+
+# Release resolved this recently (e.g. by prefetch) is reused instead of querying GitHub API again
+RELEASE_REUSE_TIME = 300
+
+# Extra space reserved on top of asset sizes for manifest, temp files and filesystem metadata
+STAGING_OVERHEAD = 64*1024*1024
+
 
 @dataclass
 class PackageMetadata:
@@ -38,6 +55,12 @@ class PackageMetadata:
     deploy_name: str = ''
 
 
+@dataclass
+class InstallationTarget:
+    installation_dir: str
+    instance: str = ''
+
+
 @dataclass
 class PackageConfig:
     latest_version: str = ''
@@ -70,6 +93,7 @@ class Package:
 
         self.security = Security(public_key=self.metadata.signature_public_key)
         self.github_client = GitHubClient(owner=self.metadata.github_repo_owner, repo=self.metadata.github_repo_name)
+        self.file_writer = FileWriter()
 
         self.active = False
         self.installed_version: str = ''
@@ -77,16 +101,45 @@ class Package:
         self.download_url: str = ''
         self.signature: Union[str, None] = None
         self.manifest = None
+        # Parsed manifest and detected installed version are reused until stats of related files change
+        self.manifest_cache_key = None
+        self.installed_version_cache_key = None
+        self.installed_version_cache = ''
 
         self.package_path = Paths.App.Resources / 'Packages' / self.metadata.package_name
+        # Prefetched assets are kept out of installation folder, so dev checkout and read-only installs stay clean
+        self.cache_path = Path(tempfile.gettempdir()) / 'XXMI-Installer' / 'Cache' / self.metadata.package_name
+        self.prefetch_lock = Lock()
+        self.prefetch_notify = False
+        self.cancel_token = CancellationToken()
         self.downloaded_asset_path: Union[Path, None] = None
         self.installed_asset_path: Union[Path, None] = None
+        self.latest_version_detect_time = 0
 
     def get_installed_version(self) -> str:
         raise NotImplementedError(f'Method "get_installed_version" is not implemented for package {self.metadata.package_name}!')
 
+    def get_installed_version_probes(self) -> Optional[List[Path]]:
+        # Files checked by get_installed_version, None disables caching of detected version
+        return None
+
+    def get_cached_installed_version(self) -> str:
+        probes = self.get_installed_version_probes()
+        if probes is None:
+            return self.get_installed_version()
+        cache_key = Paths.get_stat_key(probes)
+        if cache_key != self.installed_version_cache_key:
+            self.installed_version_cache = self.get_installed_version()
+            self.installed_version_cache_key = cache_key
+        return self.installed_version_cache
+
+    def clear_cache(self):
+        self.manifest_cache_key = None
+        self.installed_version_cache_key = None
+        self.installed_version_cache = ''
+
     def get_last_installed_version(self):
-        installed_version = self.get_installed_version()
+        installed_version = self.get_cached_installed_version()
         try:
             # If detected version is different from the last deployed one, use it as result
             # It allows to reinstall update when user either:
@@ -110,7 +163,7 @@ class Package:
 
     def detect_installed_version(self):
         try:
-            self.installed_version = self.get_installed_version()
+            self.installed_version = self.get_cached_installed_version()
         except Exception as e:
             self.installed_version = ''
             raise ValueError(f'Failed to detect installed {self.metadata.package_name} version:\n\n{e}') from e
@@ -124,6 +177,7 @@ class Package:
     def detect_latest_version(self):
         try:
             self.cfg.latest_version, self.download_url, self.signature = self.get_latest_version()
+            self.latest_version_detect_time = time.time()
         except ConnectionRefusedError as e:
             raise e
         except Exception as e:
@@ -138,14 +192,93 @@ class Package:
 
         asset_file_name = self.metadata.asset_name_format % self.cfg.latest_version
 
+        # Speculative prefetch may be still downloading the same asset, so we'll wait for it instead of starting over
+        if self.prefetch_lock.locked():
+            Events.Fire(Events.PackageManager.StartDownload(asset_name=asset_file_name))
+        self.prefetch_notify = True
+        with self.prefetch_lock:
+            self.prefetch_notify = False
+            data = self.load_cached_data(asset_file_name)
+        if data is not None:
+            return asset_file_name, data
+
+        # Fail before downloading anything if there's no space to store the asset, unknown size is checked as 0
+        asset_size = self.github_client.fetch_content_length(self.download_url)
+        Paths.assert_free_space({self.package_path / 'TMP': asset_size + STAGING_OVERHEAD})
+
         Events.Fire(Events.PackageManager.StartDownload(asset_name=asset_file_name))
 
         return asset_file_name, self.github_client.download_data(
             self.download_url,
             block_size=128*1024,
-            update_progress_callback=self.notify_download_progress
+            update_progress_callback=self.notify_download_progress,
+            cancel_token=self.cancel_token,
         )
 
+    def prefetch_latest_version(self, cancel_token: CancellationToken):
+        with self.prefetch_lock:
+            if not self.download_url:
+                self.detect_latest_version()
+
+            asset_file_name = self.metadata.asset_name_format % self.cfg.latest_version
+            cache_path = self.cache_path / asset_file_name
+            if cache_path.is_file():
+                with open(cache_path, 'rb') as f:
+                    if self.security.verify(self.signature, f.read()):
+                        return
+                # Cached file may be truncated by interrupted write or belong to outdated release
+                cache_path.unlink()
+
+            asset_size = self.github_client.fetch_content_length(self.download_url)
+            Paths.verify_path(self.cache_path)
+            Paths.assert_free_space({self.cache_path: asset_size})
+
+            # Progress is reported only once installation is waiting for prefetch to complete
+            data = self.github_client.download_data(
+                self.download_url,
+                block_size=128*1024,
+                update_progress_callback=lambda downloaded_bytes, total_bytes:
+                    self.prefetch_notify and self.notify_download_progress(downloaded_bytes, total_bytes),
+                cancel_token=cancel_token,
+            )
+
+            if not self.security.verify(self.signature, data):
+                raise ValueError(f'Prefetched {asset_file_name} integrity verification failed!')
+
+            self.file_writer.write(cache_path, data, preallocate=True)
+            self.file_writer.commit()
+
+            log.debug(f'Prefetched {asset_file_name} to cache')
+
+    def get_cached_asset_path(self) -> Path:
+        return self.cache_path / (self.metadata.asset_name_format % self.cfg.latest_version)
+
+    def prepare_deploy(self):
+        pass
+
+    def deploy_to_target(self, target: InstallationTarget) -> bool:
+        # Installs prefetched asset to given target, returns False if target is already up to date
+        raise NotImplementedError(f'Method "deploy_to_target" is not implemented for package {self.metadata.package_name}!')
+
+    def load_cached_data(self, asset_file_name):
+        cache_path = self.cache_path / asset_file_name
+        if cache_path.is_file():
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+            # Cached asset may belong to outdated release with different signature
+            if self.security.verify(self.signature, data):
+                return data
+            cache_path.unlink()
+        # Asset may be already staged by interrupted or concurrent installer process, it's verified the same way
+        staged_path = self.package_path / 'TMP' / asset_file_name
+        if staged_path.is_file():
+            with open(staged_path, 'rb') as f:
+                data = f.read()
+            if self.security.verify(self.signature, data):
+                log.debug(f'Reusing already downloaded {asset_file_name}')
+                return data
+        return None
+
     def save_downloaded_data(self, asset_path: Path, data):
 
         Events.Fire(Events.PackageManager.StartIntegrityVerification(asset_name='downloaded data'))
@@ -156,8 +289,7 @@ class Package:
 
         Events.Fire(Events.PackageManager.StartFileWrite(asset_name=asset_path.name))
 
-        with open(asset_path, 'wb') as f:
-            f.write(data)
+        self.file_writer.write(asset_path, data, preallocate=True)
 
         Events.Fire(Events.PackageManager.StartIntegrityVerification(asset_name=asset_path.name))
 
@@ -173,12 +305,26 @@ class Package:
 
         asset_file_name, data = self.download_latest_version_data()
 
+        self.stage_downloaded_data(asset_file_name, data)
+
+    def stage_downloaded_data(self, asset_file_name, data):
         Events.Fire(Events.Application.Busy())
 
         tmp_path = self.package_path / 'TMP'
         shutil.rmtree(tmp_path, ignore_errors=True)
         Paths.verify_path(tmp_path)
 
+        try:
+            self.stage_data(tmp_path, asset_file_name, data)
+        except InterruptedError:
+            # Partially staged files are useless, and TMP is recreated by the next update anyway
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        self.file_writer.commit()
+
+    def stage_data(self, tmp_path: Path, asset_file_name, data):
+
         if asset_file_name.endswith('.zip') or asset_file_name.endswith('.msi'):
             asset_path = tmp_path / asset_file_name
         elif asset_file_name.endswith('.exe'):
@@ -201,24 +347,29 @@ class Package:
     def install_latest_version(self, clean):
         raise NotImplementedError(f'Method "install_latest_version" is not implemented for package {self.metadata.package_name}!')
 
-    def write_manifest(self, asset_path, version, signature):
+    def write_manifest(self, asset_path, version, signature, package_path: Optional[Path] = None, file_writer: Optional[FileWriter] = None):
         manifest = Manifest(
             version=str(version),
             signatures={asset_path.name: signature},
         )
-        with open(self.package_path / f'Manifest.json', 'w', encoding='utf-8') as f:
-            f.write(manifest.as_json())
+        package_path = package_path or self.package_path
+        file_writer = file_writer or self.file_writer
+        file_writer.write_text(package_path / f'Manifest.json', manifest.as_json(), atomic=True)
 
     def load_manifest(self):
         manifest = Manifest()
         manifest_path = self.package_path / 'Manifest.json'
         if not manifest_path.exists():
             raise ValueError(f'{self.metadata.package_name} package is missing manifest file!\n')
+        cache_key = Paths.get_stat_key([manifest_path])
+        if self.manifest is not None and cache_key == self.manifest_cache_key:
+            return
         try:
             manifest.from_json(manifest_path)
         except Exception as e:
             raise ValueError(f'Failed to parse {self.metadata.package_name} manifest file!\n') from e
         self.manifest = manifest
+        self.manifest_cache_key = cache_key
 
     def verify_signature(self, file_path: Path):
         if self.manifest is None:
@@ -253,12 +404,26 @@ class Package:
     def unpack(self, file_path: Path, destination_path: Path):
         Events.Fire(Events.PackageManager.StartUnpack(asset_name=file_path.name))
 
+        destination_path = Path(destination_path).resolve()
+
         with zipfile.ZipFile(file_path, 'r') as zip:
-            # Extract zip archive
-            zip.extractall(destination_path)
-            # Restore modification dates
+            # Ensure there's enough space to extract the whole archive, sizes are read from central directory
+            unpacked_size = sum(zip_info.file_size for zip_info in zip.infolist())
+            Paths.assert_free_space({destination_path: unpacked_size + STAGING_OVERHEAD})
+
             for zip_info in zip.infolist():
-                extracted_file_path = os.path.join(destination_path, zip_info.filename)
+                self.cancel_token.check()
+                extracted_file_path = (destination_path / zip_info.filename).resolve()
+                if not extracted_file_path.is_relative_to(destination_path):
+                    raise ValueError(f'{file_path.name} contains file outside of archive root: {zip_info.filename}!')
+                # Extract zip archive member with writes done according to durability policy
+                if zip_info.is_dir():
+                    extracted_file_path.mkdir(parents=True, exist_ok=True)
+                else:
+                    extracted_file_path.parent.mkdir(parents=True, exist_ok=True)
+                    with zip.open(zip_info) as f:
+                        self.file_writer.copy_stream(f, extracted_file_path, size=zip_info.file_size)
+                # Restore modification dates
                 timestamp = time.mktime(zip_info.date_time + (0, 0, -1))
                 os.utime(extracted_file_path, (timestamp, timestamp))
 
@@ -270,7 +435,7 @@ class Package:
             time.sleep(0.01)
             destination_path.unlink()
         time.sleep(0.01)
-        shutil.move(source_path, destination_path)
+        self.file_writer.move(source_path, destination_path)
 
     def move_contents(self, source_path: Path, destination_path: Path):
         Paths.verify_path(destination_path)
@@ -283,21 +448,33 @@ class Package:
         shutil.rmtree(source_path)
 
     def get_file_version(self, file_path, max_parts=4):
-        version_info = GetFileVersionInfo(str(file_path), "\\")
-
-        ms_file_version = version_info['FileVersionMS']
-        ls_file_version = version_info['FileVersionLS']
-
-        version = [str(HIWORD(ms_file_version)), str(LOWORD(ms_file_version)),
-                   str(HIWORD(ls_file_version)), str(LOWORD(ls_file_version))]
-
-        return '.'.join(version[:max_parts])
+        return pe_version.get_file_version(file_path, max_parts=max_parts)
 
     def update(self, clean=False):
+        self.install_update(self.verify_update(self.download_update()), clean=clean)
+
+    def download_update(self):
+        # Update stages are separated to let PackageManager pipeline them across multiple packages
         if not self.download_url:
             self.detect_latest_version()
-        self.download_latest_version()
+        self.downloaded_asset_path = None
+        return self.download_latest_version_data()
+
+    def verify_update(self, downloaded):
+        if downloaded is None:
+            return None
+        self.cancel_token.check()
+        asset_file_name, data = downloaded
+        self.stage_downloaded_data(asset_file_name, data)
+        return asset_file_name
+
+    def install_update(self, staged, clean=False):
+        if staged is None:
+            return
+        # Installation itself can't be interrupted safely, so it's the last chance to cancel
+        self.cancel_token.check()
         self.install_latest_version(clean=clean)
+        self.clear_cache()
         self.load_manifest()
         self.detect_installed_version()
         self.cfg.deployed_version = self.installed_version
@@ -326,50 +503,68 @@ class PackageState:
 
 @dataclass
 class PackageManagerConfig:
+    durability: str = str(Durability.Fast)
     packages: Dict[str, PackageConfig] = field(default_factory=lambda: {})
 
 
 @dataclass
 class PackageManagerEvents:
 
-    @dataclass
+    @dataclass(slots=True)
     class StartCheckUpdate:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class InitializeDownload:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class StartDownload:
         asset_name: str
 
-    @dataclass
+    @dataclass(slots=True)
     class UpdateDownloadProgress:
+        log_sample_rate: ClassVar[int] = 100
+        coalesce: ClassVar[RateLimit] = RateLimit(hz=20)
         downloaded_bytes: int
         total_bytes: int
 
-    @dataclass
+    @dataclass(slots=True)
     class StartIntegrityVerification:
         asset_name: str
 
-    @dataclass
+    @dataclass(slots=True)
     class InitializeInstallation:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class StartFileWrite:
         asset_name: str
 
-    @dataclass
+    @dataclass(slots=True)
     class StartFileMove:
         asset_name: str
 
-    @dataclass
+    @dataclass(slots=True)
     class StartUnpack:
         asset_name: str
 
-    @dataclass
+    @dataclass(slots=True)
+    class PauseDownload:
+        pass
+
+    @dataclass(slots=True)
+    class ResumeDownload:
+        pass
+
+    @dataclass(slots=True)
+    class TargetInstallResult:
+        installation_dir: str
+        instance: str
+        result: str
+        message: str = ''
+
+    @dataclass(slots=True)
     class VersionNotification:
         auto_update: bool
         package_states: Dict[str, PackageState]
@@ -378,28 +573,37 @@ class PackageManagerEvents:
 class PackageManager:
     def __init__(self, packages: Optional[List[Package]] = None):
         self.packages: Dict[str, Package] = {}
+        self.dependency_graph = DependencyGraph()
         if packages is not None:
             for package in packages:
                 self.register_package(package)
         self.update_running = False
         self.api_connection_refused = False
         self.api_connection_refused_notified = False
+        self.cancel_token = CancellationToken()
+        self.prefetch_token = CancellationToken()
+        Events.Subscribe(Events.PackageManager.PauseDownload, lambda event: self.pause(), thread_safe=True)
+        Events.Subscribe(Events.PackageManager.ResumeDownload, lambda event: self.resume(), thread_safe=True)
 
     def register_package(self, package: Package):
+        self.dependency_graph.add(package.metadata.package_name, package.metadata.dependencies)
         self.packages[package.metadata.package_name] = package
 
         if package.metadata.package_name not in Config.Packages.packages:
             Config.Packages.packages[package.metadata.package_name] = PackageConfig()
         package.cfg = Config.Packages.packages[package.metadata.package_name]
+        package.file_writer = FileWriter(durability=Durability(Config.Packages.durability))
 
         if package.metadata.auto_load:
             self.load_package(package)
 
     def load_package(self, package: Union[Package, str]):
         package = self.get_package(package)
-        # Load required packages
-        for required_package in package.metadata.dependencies:
-            self.load_package(required_package)
+        # Load required packages before the package itself, each of them only once
+        for level in self.get_package_levels(self.dependency_graph.get_closure([package.metadata.package_name])):
+            self.run_concurrently(self.activate_package, level)
+
+    def activate_package(self, package: Package):
         # Mark package as active
         package.load()
         # Detect installed version to do a basic integrity check
@@ -410,9 +614,15 @@ class PackageManager:
 
     def unload_package(self, package: Union[Package, str]):
         package = self.get_package(package)
-        package.unload()
-        for required_package in package.metadata.dependencies:
-            self.unload_package(required_package)
+        # Unload the package itself before packages it requires
+        for level in reversed(self.get_package_levels(self.dependency_graph.get_closure([package.metadata.package_name]))):
+            for required_package in level:
+                required_package.unload()
+
+    def get_package_levels(self, packages: Iterable[Union[Package, str]]) -> List[List[Package]]:
+        package_names = [self.get_package(package).metadata.package_name for package in packages]
+        return [[self.packages[package_name] for package_name in level]
+                for level in self.dependency_graph.get_subset_levels(package_names)]
 
     def get_package(self, package: Union[Package, str]) -> Package:
         if isinstance(package, str):
@@ -432,10 +642,20 @@ class PackageManager:
             },
         )
 
-    def detect_package_versions(self):
-        for package_name, package in self.packages.items():
-            if package.active:
-                package.detect_installed_version()
+    def get_active_packages(self, packages=None) -> List[Package]:
+        return [package for package_name, package in self.packages.items()
+                if package.active and (packages is None or package_name in packages)]
+
+    def run_concurrently(self, callback, items: list, concurrent=True) -> list:
+        # Results are returned in the same order as items, first raised exception is passed to caller
+        if not concurrent or len(items) < 2:
+            return [callback(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(len(items), MAX_CHECK_WORKERS)) as executor:
+            return list(executor.map(callback, items))
+
+    def detect_package_versions(self, concurrent=True):
+        for level in self.get_package_levels(self.get_active_packages()):
+            self.run_concurrently(lambda package: package.detect_installed_version(), level, concurrent)
 
     def notify_package_versions(self, detect_installed: bool = False):
         if detect_installed:
@@ -447,37 +667,36 @@ class PackageManager:
             if package.update_available():
                 return True
 
-    def update_packages(self, no_install=False, no_check=False, force=False, reinstall=False, packages=None, silent=False):
-        log.debug(f'Initializing packages update (no_install={no_install}, no_check={no_check}, force={force}, reinstall={reinstall}, silent={silent}, packages={packages})...')
+    def update_packages(self, no_install=False, no_check=False, force=False, reinstall=False, packages=None, silent=False, concurrent=True):
+        log.debug(f'Initializing packages update (no_install={no_install}, no_check={no_check}, force={force}, reinstall={reinstall}, silent={silent}, packages={packages}, concurrent={concurrent})...')
 
         if self.update_running:
             log.debug(f'Packages update canceled: update is already in process!')
             return
         self.update_running = True
         self.api_connection_refused = False
+        self.start_operation()
 
         if not silent:
             Events.Fire(Events.Application.Busy())
             Events.Fire(Events.PackageManager.StartCheckUpdate())
 
         try:
-            for package_name, package in self.packages.items():
+            # Skip processing of inactive packages and ones not listed in provided package list
+            active_packages = self.get_active_packages(packages)
 
-                # Skip package processing if it's not active, intended for multiple model importers support
-                if not package.active:
-                    continue
+            # Detect installed and latest versions of all packages at once, it takes as long as the slowest check
+            checked = self.run_concurrently(
+                lambda package: self.check_package_update(package, no_install=no_install, no_check=no_check, force=force, reinstall=reinstall),
+                active_packages, concurrent)
 
-                # Skip package processing if it's name isn't listed in provided package list
-                if packages is not None and package_name not in packages:
-                    continue
+            # Skip packages that failed update check or have nothing to install
+            pending_packages = [package for package, check_passed in zip(active_packages, checked)
+                                if check_passed and self.install_pending(package, no_install=no_install, force=force, reinstall=reinstall)]
 
-                # Download and install the latest package version, it can take a while
-                updated = self.update_package(package, no_install=no_install, no_check=no_check, force=force, reinstall=reinstall)
-
-                if no_install:
-                    continue
-
-                if package.metadata.exit_after_update and updated:
+            # Download and install the latest package versions, it can take a while
+            for package in self.install_package_updates(pending_packages, clean=reinstall, concurrent=concurrent):
+                if package.metadata.exit_after_update:
                     Events.Fire(Events.Application.Close(delay=500))
                     return
 
@@ -485,6 +704,9 @@ class PackageManager:
                 self.api_connection_refused_notified = True
                 raise ConnectionRefusedError(f'GitHub update requests limit reached!\n\nAttempts will be ignored for an hour.')
 
+        except InterruptedError:
+            log.debug(f'Packages update canceled')
+
         except Exception as e:
             if silent:
                 log.exception(e)
@@ -498,6 +720,11 @@ class PackageManager:
                 Events.Fire(Events.Application.Ready())
 
     def update_package(self, package: Package, no_install=False, no_check=False, force=False, reinstall=False):
+        if not self.check_package_update(package, no_install=no_install, no_check=no_check, force=force, reinstall=reinstall):
+            return False
+        return self.install_package_update(package, no_install=no_install, force=force, reinstall=reinstall)
+
+    def check_package_update(self, package: Package, no_install=False, no_check=False, force=False, reinstall=False):
         # Check if installation is pending, as we'll need download url from update check
         install = not no_install and (package.update_available() or reinstall) and (Config.Launcher.auto_update or force)
 
@@ -510,9 +737,11 @@ class PackageManager:
         force_check = not no_check and (force or install or package.cfg.update_check_time > current_time)
         # We're going to throttle query to 1 per hour by default, else user can be temporary banned by GitHub
         if force_check or package.cfg.update_check_time + 3600 < current_time:
+            if package.download_url and current_time - package.latest_version_detect_time < RELEASE_REUSE_TIME:
+                return True
             package.cfg.update_check_time = current_time
             if self.api_connection_refused:
-                return
+                return False
             try:
                 package.detect_latest_version()
             except ConnectionRefusedError as e:
@@ -521,16 +750,114 @@ class PackageManager:
                 return False
             self.api_connection_refused_notified = False
 
+        return True
+
+    def install_pending(self, package: Package, no_install=False, force=False, reinstall=False):
         # Check if installation is pending again, as update check may find new version
-        install = not no_install and (package.update_available() or reinstall) and (Config.Launcher.auto_update or force)
+        return not no_install and (package.update_available() or reinstall) and (Config.Launcher.auto_update or force)
 
+    def install_package_update(self, package: Package, no_install=False, force=False, reinstall=False):
         # Download and install the latest package version, it can take a while
-        if install:
+        if self.install_pending(package, no_install=no_install, force=force, reinstall=reinstall):
             package.update(clean=reinstall)
             return True
 
         return False
 
+    def install_package_updates(self, packages: List[Package], clean=False, concurrent=True):
+        levels = self.get_package_levels(packages)
+        if not concurrent or len(packages) < 2:
+            for level in levels:
+                for package in level:
+                    package.update(clean=clean)
+                    yield package
+            return
+        # Packages of the same dependency level are processed in parallel
+        # Download of the next level runs while the previous one is verified and installed
+        # Installation happens in the calling thread, level by level in dependency order
+        pipeline = Pipeline([
+            lambda level, _: self.run_concurrently(
+                lambda package: package.download_update(), level),
+            lambda level, downloaded: self.run_concurrently(
+                lambda args: args[0].verify_update(args[1]), list(zip(level, downloaded))),
+            lambda level, staged: self.run_concurrently(
+                lambda args: args[0].install_update(args[1], clean=clean), list(zip(level, staged))),
+        # Downloads of the next levels are interrupted if operation fails or caller stops early
+        ], on_stop=lambda: self.cancel_token.cancel())
+        for level, _ in pipeline.run(levels):
+            yield from level
+
+    def start_operation(self):
+        # Token is replaced for every operation, as canceled token can't be reused
+        self.cancel_token = CancellationToken()
+        for package in self.packages.values():
+            package.cancel_token = self.cancel_token
+        # Pause left over from previous download must not block this one via prefetch lock
+        self.prefetch_token.resume()
+
+    def pause(self):
+        self.cancel_token.pause()
+        self.prefetch_token.pause()
+
+    def resume(self):
+        self.cancel_token.resume()
+        self.prefetch_token.resume()
+
+    def cancel(self):
+        self.cancel_token.cancel()
+        self.prefetch_token.cancel()
+
+    def prefetch_packages(self, packages=None):
+        # Fresh token drops stale pause state, but cancellation requested before the start is kept
+        if not self.prefetch_token.is_canceled():
+            self.prefetch_token = CancellationToken()
+        for package in self.get_active_packages(packages):
+            try:
+                # Release is resolved via the same throttled check as updates, installation reuses it later
+                if not self.check_package_update(package, no_install=True) or not package.download_url:
+                    log.debug(f'Prefetch of {package.metadata.package_name} package skipped: latest release is unknown')
+                    continue
+                package.prefetch_latest_version(self.prefetch_token)
+            except InterruptedError:
+                log.debug(f'Prefetch of {package.metadata.package_name} package canceled')
+                return
+            except Exception as e:
+                # Prefetch is speculative, installation will download the package itself on failure
+                log.debug(f'Prefetch of {package.metadata.package_name} package failed: {e}')
+
+    def batch_install(self, package: Union[Package, str], targets: List[InstallationTarget], max_workers=1) -> List[str]:
+        package = self.get_package(package)
+
+        self.start_operation()
+
+        Events.Fire(Events.Application.Busy())
+        Events.Fire(Events.PackageManager.StartCheckUpdate())
+
+        # Download and verify the asset only once, every target gets a copy of the same verified file
+        package.detect_latest_version()
+        package.prefetch_latest_version(self.cancel_token)
+        package.prepare_deploy()
+
+        def deploy(target: InstallationTarget):
+            try:
+                result, message = ('Installed' if package.deploy_to_target(target) else 'Skipped'), ''
+            except Exception as e:
+                log.exception(e)
+                result, message = 'Failed', str(e)
+            Events.Fire(Events.PackageManager.TargetInstallResult(
+                installation_dir=target.installation_dir,
+                instance=target.instance,
+                result=result,
+                message=message,
+            ))
+            return result
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                return list(executor.map(deploy, targets))
+        finally:
+            Events.Fire(Events.Application.Ready())
+
     def skip_latest_updates(self):
         for package in self.packages.values():
             package.cfg.skipped_version = package.cfg.latest_version
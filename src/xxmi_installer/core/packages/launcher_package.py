@@ -1,31 +1,37 @@
-import winshell
-import pythoncom
+import logging
+import shutil
 import subprocess
 
 from dataclasses import dataclass
 from pathlib import Path
+from threading import Lock
+from typing import Optional
 
 import core.path_manager as Paths
 import core.event_manager as Events
 import core.config_manager as Config
 
-from core.package_manager import Package, PackageMetadata
+from core.package_manager import Package, PackageMetadata, Manifest, InstallationTarget
 
+from core.utils.file_writer import FileWriter
 from core.utils.process_tracker import wait_for_process, wait_for_process_exit, WaitResult
+from core.utils import msi_reader
+
+log = logging.getLogger(__name__)
 
 
 @dataclass
 class LauncherManagerEvents:
 
-    @dataclass
+    @dataclass(slots=True)
     class AssertInstallationFolder:
         installation_folder: str
 
-    @dataclass
+    @dataclass(slots=True)
     class StartCreateShortcuts:
         pass
 
-    @dataclass
+    @dataclass(slots=True)
     class StartLauncher:
         asset_name: str
 
@@ -39,7 +45,7 @@ class LauncherManagerConfig:
 
 
 class LauncherPackage(Package):
-    def __init__(self):
+    def __init__(self, skip_installed_version: bool = False):
         super().__init__(PackageMetadata(
             package_name='Launcher',
             auto_load=True,
@@ -53,14 +59,82 @@ class LauncherPackage(Package):
         ))
         Events.Subscribe(Events.LauncherManager.AssertInstallationFolder,
                          lambda event: self.assert_installation_folder(event.installation_folder))
+        # Windows Installer handles only one installation at a time
+        self.msiexec_lock = Lock()
+        # Reinstall of already installed version is skipped only in updater mode, installer mode uses it to repair launcher
+        self.skip_installed_version = skip_installed_version
+
+    def get_package_path(self, installation_dir: Optional[Path] = None):
+        installation_dir = Path(installation_dir or Config.Launcher.installation_dir)
+        return installation_dir / 'Resources' / 'Packages' / self.metadata.package_name
 
-    def download_latest_version(self):
-        self.package_path = Path(Config.Launcher.installation_dir) / 'Resources' / 'Packages' / self.metadata.package_name
-        super().download_latest_version()
+    def download_latest_version_data(self):
+        self.package_path = self.get_package_path()
+        return super().download_latest_version_data()
 
     def get_installed_version(self):
+        self.package_path = self.get_package_path()
+        return self.get_deployed_version(Path(Config.Launcher.installation_dir))
+
+    def get_deployed_version(self, installation_dir: Path):
+        launcher_path = installation_dir / 'XXMI Launcher.exe'
+        if not launcher_path.is_file():
+            return ''
+        # Launcher is deployed by msiexec, so the version is read from .msi recorded in manifest of the last download
+        package_path = self.get_package_path(installation_dir)
+        try:
+            manifest = Manifest()
+            manifest.from_json(package_path / 'Manifest.json')
+            for asset_name, signature in manifest.signatures.items():
+                msi_path = package_path / 'TMP' / asset_name
+                if msi_path.suffix != '.msi' or not msi_path.is_file():
+                    continue
+                with open(msi_path, 'rb') as f:
+                    if not self.security.verify(signature, f.read()):
+                        continue
+                version = '.'.join(msi_reader.get_product_version(msi_path).split('.')[:3])
+                # Ensure that .msi was actually installed and not just downloaded, unverifiable install is treated as outdated
+                try:
+                    launcher_version = self.get_file_version(launcher_path, max_parts=3)
+                except ValueError as e:
+                    log.debug(f'Failed to read {launcher_path.name} version: {e}')
+                    return '0.0.0'
+                if launcher_version == version:
+                    return version
+        except Exception as e:
+            log.debug(f'Failed to detect deployed {self.metadata.package_name} version: {e}')
         return '0.0.0'
 
+    def get_installed_version_probes(self):
+        package_path = self.get_package_path()
+        return [
+            Path(Config.Launcher.installation_dir) / 'XXMI Launcher.exe',
+            package_path / 'Manifest.json',
+            # Folder is recreated on every download, so its stat changes along with cached .msi
+            package_path / 'TMP',
+        ]
+
+    def download_update(self):
+        if not self.download_url:
+            self.detect_latest_version()
+        # Skip download and installation if the latest version is already deployed to installation folder
+        if self.skip_installed_version and self.get_cached_installed_version() == self.cfg.latest_version:
+            log.debug(f'{self.metadata.package_name} {self.cfg.latest_version} is already installed, skipping update')
+            return None
+        return super().download_update()
+
+    def install_update(self, staged, clean=False):
+        if staged is not None:
+            super().install_update(staged, clean=clean)
+            return
+        # Launcher that called updater may be still running, so it's stopped just like before msiexec
+        self.stop_launcher()
+        if Config.Launcher.create_shortcut:
+            self.create_shortcut()
+        self.start_launcher()
+        self.detect_installed_version()
+        self.cfg.deployed_version = self.installed_version
+
     def install_latest_version(self, clean):
         Events.Fire(Events.PackageManager.InitializeInstallation())
 
@@ -70,9 +144,7 @@ class LauncherPackage(Package):
 
         Events.Fire(Events.LauncherManager.StartLauncher(asset_name=self.downloaded_asset_path.name))
 
-        shortcuts_property = 'CheckBox' if Config.Launcher.create_shortcut else ''
-
-        subprocess.Popen(f'msiexec /i "{self.downloaded_asset_path}" /qr /norestart APPDIR="{Path(Config.Launcher.installation_dir)}" CREATE_SHORTCUTS="{shortcuts_property}"', shell=True)
+        self.run_msiexec(self.downloaded_asset_path, Path(Config.Launcher.installation_dir), Config.Launcher.create_shortcut)
 
         installer_process_name = 'EnhancedUI.exe'
 
@@ -83,6 +155,50 @@ class LauncherPackage(Package):
             raise ValueError(f'Failed to start {self.downloaded_asset_path.name}!\n\n'
                              f'Was it blocked by Antivirus software or security settings?')
 
+    def run_msiexec(self, asset_path: Path, installation_dir: Path, create_shortcut: bool, wait: bool = False):
+        shortcuts_property = 'CheckBox' if create_shortcut else ''
+        if not wait:
+            subprocess.Popen(f'msiexec /i "{asset_path}" /qr /norestart APPDIR="{installation_dir}" CREATE_SHORTCUTS="{shortcuts_property}"', shell=True)
+            return
+        result = subprocess.run(f'msiexec /i "{asset_path}" /qn /norestart APPDIR="{installation_dir}" CREATE_SHORTCUTS="{shortcuts_property}"', shell=True)
+        # 3010 stands for success with pending reboot
+        if result.returncode not in (0, 3010):
+            raise ValueError(f'Failed to install {asset_path.name} to {installation_dir}: msiexec exit code {result.returncode}!')
+
+    def prepare_deploy(self):
+        self.stop_launcher()
+
+    def deploy_to_target(self, target: InstallationTarget):
+        installation_dir = Path(target.installation_dir)
+
+        self.assert_installation_folder(str(installation_dir))
+
+        if self.get_deployed_version(installation_dir) == self.cfg.latest_version:
+            log.debug(f'{self.metadata.package_name} {self.cfg.latest_version} is already installed to {installation_dir}')
+            return False
+
+        # Copy verified asset to target package folder, it keeps installed version detectable for the target
+        asset_path = self.get_cached_asset_path()
+        package_path = self.get_package_path(installation_dir)
+        tmp_path = package_path / 'TMP'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        Paths.verify_path(tmp_path)
+        target_asset_path = tmp_path / asset_path.name
+        # Targets are deployed in parallel, so each of them tracks and commits only its own folders
+        file_writer = FileWriter(self.file_writer.durability)
+        with open(asset_path, 'rb') as f:
+            file_writer.copy_stream(f, target_asset_path, size=asset_path.stat().st_size)
+        self.write_manifest(target_asset_path, self.cfg.latest_version, self.signature, package_path=package_path, file_writer=file_writer)
+        file_writer.commit()
+
+        with self.msiexec_lock:
+            self.run_msiexec(target_asset_path, installation_dir, create_shortcut=False, wait=True)
+
+        if target.instance:
+            self.start_launcher(installation_dir, target.instance)
+
+        return True
+
     def assert_installation_folder(self, installation_folder: str):
         installation_path = Path(installation_folder)
 
@@ -110,6 +226,8 @@ class LauncherPackage(Package):
             ))
 
     def create_shortcut(self):
+        import winshell
+        import pythoncom
         Events.Fire(Events.LauncherManager.StartCreateShortcuts())
         pythoncom.CoInitialize()
         with winshell.shortcut(str(Path(winshell.desktop()) / 'XXMI Launcher.lnk')) as link:
@@ -117,13 +235,14 @@ class LauncherPackage(Package):
             link.description = "Shortcut to XXMI Launcher"
             link.working_directory = Config.Launcher.installation_dir
 
-    def start_launcher(self):
-        launcher_path = Path(Config.Launcher.installation_dir) / 'XXMI Launcher.exe'
+    def start_launcher(self, installation_dir: Optional[Path] = None, instance: Optional[str] = None):
+        launcher_path = Path(installation_dir or Config.Launcher.installation_dir) / 'XXMI Launcher.exe'
+        instance = instance or Config.Launcher.instance
         Events.Fire(Events.LauncherManager.StartLauncher(asset_name=launcher_path.name))
         if not launcher_path.exists():
             raise ValueError(f'Failed to locate {launcher_path.name}!\nWas it removed by your Antivirus software?')
-        if Config.Launcher.instance:
-            subprocess.Popen([launcher_path, '--update', '--xxmi', Config.Launcher.instance])
+        if instance:
+            subprocess.Popen([launcher_path, '--update', '--xxmi', instance])
         else:
             subprocess.Popen([launcher_path, '--update'])
         result, pid = wait_for_process(launcher_path.name, timeout=15, with_window=True)
@@ -1,7 +1,9 @@
 import os
+import shutil
 
 from pathlib import Path
 from dataclasses import dataclass, fields
+from typing import Dict, List, Tuple, Union
 
 
 def assert_path(directory_path: Path):
@@ -37,6 +39,49 @@ def can_create_dir(directory_path: Path):
         can_create_dir(directory_path.parent)
 
 
+def get_existing_path(path: Path):
+    path = Path(path).absolute()
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return path
+
+
+def get_stat_key(paths: List[Path]) -> Tuple[Tuple[str, Union[int, None], Union[int, None]], ...]:
+    # Changes whenever any of files is created, removed, resized or modified
+    stat_key = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stat_key.append((str(path), stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stat_key.append((str(path), None, None))
+    return tuple(stat_key)
+
+
+def format_size(num_bytes):
+    units = ('B', 'KB', 'MB', 'GB', 'TB')
+    for power, unit in enumerate(units):
+        if num_bytes < 1024 ** (power + 1):
+            return '%.2f%s' % (num_bytes / 1024 ** power, unit)
+    return '%.2f%s' % (num_bytes / 1024 ** (len(units) - 1), units[-1])
+
+
+def assert_free_space(required_space: Dict[Path, int]):
+    # Sum up space requirements of all paths located on the same volume
+    volumes = {}
+    for path, num_bytes in required_space.items():
+        path = get_existing_path(path)
+        volume_id = os.stat(path).st_dev
+        volume_path, volume_bytes = volumes.get(volume_id, (path, 0))
+        volumes[volume_id] = (volume_path, volume_bytes + num_bytes)
+    for volume_path, num_bytes in volumes.values():
+        free_bytes = shutil.disk_usage(volume_path).free
+        if free_bytes < num_bytes:
+            raise ValueError(f"Not enough free disk space for '{volume_path}' folder!\n\n"
+                             f'Required: {format_size(num_bytes)}\n'
+                             f'Available: {format_size(free_bytes)}')
+
+
 @dataclass
 class Paths:
     Root: Path = Path('')
@@ -0,0 +1,73 @@
+import sys
+import json
+import time
+import logging
+
+from dataclasses import is_dataclass, asdict, fields
+
+import core.event_manager as Events
+
+log = logging.getLogger(__name__)
+
+
+class ProgressSink:
+    """
+    Reports events of application core to text stream, used instead of GUI in headless mode
+    Windowed builds have no stdout, so lines are written to log instead
+    """
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def subscribe(self):
+        for events in (Events.Application, Events.PackageManager, Events.LauncherManager):
+            for event in vars(events).values():
+                if isinstance(event, type) and is_dataclass(event):
+                    Events.Subscribe(event, self.handle_event, caller_id=self, thread_safe=True)
+
+    def unsubscribe(self):
+        Events.Unsubscribe(caller_id=self)
+
+    def handle_event(self, event):
+        raise NotImplementedError
+
+    def write(self, line: str):
+        if self.stream is None:
+            log.info(line)
+            return
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+
+class ConsoleProgressSink(ProgressSink):
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.download_progress = -1
+
+    def handle_event(self, event):
+        if isinstance(event, Events.Application.MoveWindow):
+            return
+        if isinstance(event, Events.PackageManager.UpdateDownloadProgress):
+            # Report download progress in 10% steps to keep output readable
+            progress = int(event.downloaded_bytes * 10 / event.total_bytes) * 10 if event.total_bytes else 0
+            if progress == self.download_progress:
+                return
+            self.download_progress = progress
+            self.write(f'Downloading: {progress}%')
+            return
+        if isinstance(event, Events.PackageManager.StartDownload):
+            self.download_progress = -1
+        if isinstance(event, Events.Application.ShowMessage):
+            self.write(f'[{event.title}] {event.message}')
+            return
+        values = ', '.join(f'{field.name}={getattr(event, field.name)}' for field in fields(event))
+        self.write(f'{event.__class__.__name__}' + (f': {values}' if values else ''))
+
+
+class JsonLinesProgressSink(ProgressSink):
+    def handle_event(self, event):
+        if isinstance(event, Events.Application.MoveWindow):
+            return
+        data = {'event': event.__class__.__qualname__, 'time': time.time()}
+        # Shallow copy, as events may carry callbacks that can't be deep copied by asdict
+        data.update({field.name: getattr(event, field.name) for field in fields(event)})
+        self.write(json.dumps(data, default=lambda value: asdict(value) if is_dataclass(value) else str(value)))
@@ -0,0 +1,37 @@
+from threading import Event
+
+
+class CancellationToken:
+    """
+    Lets long operation to be canceled or paused from another thread
+    Operation checks the token at safe points, e.g. download block boundaries and between update stages
+    """
+    def __init__(self):
+        self.canceled = Event()
+        self.running = Event()
+        self.running.set()
+
+    def cancel(self):
+        self.canceled.set()
+        # Wake up paused operation, so it can exit
+        self.running.set()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def is_canceled(self) -> bool:
+        return self.canceled.is_set()
+
+    def is_paused(self) -> bool:
+        return not self.running.is_set()
+
+    def check(self):
+        if self.canceled.is_set():
+            raise InterruptedError('Operation canceled!')
+
+    def wait_resumed(self):
+        self.running.wait()
+        self.check()
@@ -0,0 +1,24 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class LatestWins:
+    """
+    Event is delivered at the end of the window, events of the same class fired within it replace the pending one
+    """
+    window_ms: int
+
+    def get_delay(self, now: float, last_delivery: float) -> float:
+        return self.window_ms / 1000
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    Event is delivered right away unless previous one was delivered less than 1/hz ago
+    Otherwise it's held until the next slot and replaced by events of the same class fired in the meantime
+    """
+    hz: float
+
+    def get_delay(self, now: float, last_delivery: float) -> float:
+        return max(0.0, last_delivery + 1 / self.hz - now)
@@ -0,0 +1,81 @@
+from typing import Dict, List, Iterable, Set, Union, FrozenSet
+
+
+class DependencyGraph:
+    """
+    Keeps track of dependencies between named nodes and resolves them into topological levels
+    Nodes of the same level don't depend on each other, every node depends only on nodes from previous levels
+    """
+    def __init__(self):
+        self.dependencies: Dict[str, List[str]] = {}
+        self.levels: Dict[FrozenSet[str], List[List[str]]] = {}
+
+    def add(self, name: str, dependencies: Iterable[str]):
+        previous_dependencies = self.dependencies.get(name, None)
+        self.dependencies[name] = list(dict.fromkeys(dependencies))
+        self.levels = {}
+        cycle = self.find_cycle(name)
+        if cycle is not None:
+            if previous_dependencies is None:
+                del self.dependencies[name]
+            else:
+                self.dependencies[name] = previous_dependencies
+            raise ValueError(f'Circular dependency detected: {" -> ".join(cycle)}!')
+
+    def find_cycle(self, name: str, path: Union[List[str], None] = None) -> Union[List[str], None]:
+        path = path or []
+        if name in path:
+            return path[path.index(name):] + [name]
+        # Dependencies that aren't registered yet can't close a cycle
+        for dependency in self.dependencies.get(name, []):
+            cycle = self.find_cycle(dependency, path + [name])
+            if cycle is not None:
+                return cycle
+        return None
+
+    def get_levels(self, names: Union[Iterable[str], None] = None) -> List[List[str]]:
+        """
+        Returns topological levels of provided nodes and all their dependencies, or of the whole graph by default
+        """
+        nodes = frozenset(self.dependencies.keys() if names is None else self.get_closure(names))
+        levels = self.levels.get(nodes, None)
+        if levels is None:
+            levels = self.resolve_levels(nodes)
+            self.levels[nodes] = levels
+        return levels
+
+    def resolve_levels(self, nodes: FrozenSet[str]) -> List[List[str]]:
+        for name in nodes:
+            for dependency in self.dependencies.get(name, [name]):
+                if dependency not in self.dependencies:
+                    raise ValueError(f'Unknown dependency {dependency}!')
+        levels = []
+        resolved: Set[str] = set()
+        pending = [name for name in self.dependencies.keys() if name in nodes]
+        while pending:
+            level = [name for name in pending if all(dependency in resolved for dependency in self.dependencies[name])]
+            if not level:
+                raise ValueError(f'Circular dependency detected between: {", ".join(pending)}!')
+            levels.append(level)
+            resolved.update(level)
+            pending = [name for name in pending if name not in resolved]
+        return levels
+
+    def get_closure(self, names: Iterable[str]) -> Set[str]:
+        closure = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in closure:
+                continue
+            closure.add(name)
+            pending.extend(self.dependencies.get(name, []))
+        return closure
+
+    def get_subset_levels(self, names: Iterable[str]) -> List[List[str]]:
+        """
+        Returns topological levels of provided nodes only, ordered as if their dependencies were included
+        """
+        names = set(names)
+        levels = [[name for name in level if name in names] for level in self.get_levels(names)]
+        return [level for level in levels if level]
@@ -0,0 +1,109 @@
+import os
+import shutil
+
+from enum import Enum
+from pathlib import Path
+from typing import Set
+
+
+class Durability(Enum):
+    Fast = 'Fast'
+    Safe = 'Safe'
+
+    def __str__(self):
+        return self.value
+
+
+class FileWriter:
+    """
+    Writes files to disk according to selected durability policy
+    Fast: large buffered writes, flushing is deferred until commit(), which fsyncs every touched folder once
+    Safe: every file is fsynced on close, atomic writes go through temp file and rename
+    """
+    def __init__(self, durability: Durability = Durability.Safe, buffer_size: int = 4*1024*1024):
+        self.durability = Durability(durability)
+        self.buffer_size = buffer_size
+        self.pending_dirs: Set[Path] = set()
+
+    def is_safe(self):
+        return self.durability == Durability.Safe
+
+    def write(self, file_path: Path, data, atomic: bool = False, preallocate: bool = False):
+        if atomic and self.is_safe():
+            tmp_path = file_path.with_name(f'{file_path.name}.tmp')
+            self._write(tmp_path, data, preallocate)
+            os.replace(tmp_path, file_path)
+            self.sync_dir(file_path.parent)
+        else:
+            self._write(file_path, data, preallocate)
+            self.touch_dir(file_path.parent)
+
+    def write_text(self, file_path: Path, text: str, encoding: str = 'utf-8', atomic: bool = False):
+        self.write(file_path, text.encode(encoding), atomic=atomic)
+
+    def copy_stream(self, source, file_path: Path, size: int = 0):
+        with open(file_path, 'wb', buffering=self.buffer_size) as f:
+            self.preallocate(f, size)
+            shutil.copyfileobj(source, f, self.buffer_size)
+            self._flush(f)
+        self.touch_dir(file_path.parent)
+
+    def move(self, source_path: Path, destination_path: Path):
+        shutil.move(source_path, destination_path)
+        if self.is_safe():
+            self.sync_dir(destination_path.parent)
+        else:
+            self.touch_dir(destination_path.parent)
+
+    def touch_dir(self, dir_path: Path):
+        if self.is_safe():
+            return
+        self.pending_dirs.add(Path(dir_path))
+
+    def commit(self):
+        pending_dirs, self.pending_dirs = self.pending_dirs, set()
+        for dir_path in pending_dirs:
+            self.sync_dir(dir_path)
+
+    def _write(self, file_path: Path, data, preallocate: bool = False):
+        with open(file_path, 'wb', buffering=self.buffer_size) as f:
+            if preallocate:
+                self.preallocate(f, len(data))
+            f.write(data)
+            self._flush(f)
+
+    def _flush(self, f):
+        if not self.is_safe():
+            return
+        f.flush()
+        os.fsync(f.fileno())
+
+    @staticmethod
+    def preallocate(f, size: int):
+        # Reserve whole file size upfront to let filesystem allocate it in one contiguous run
+        if size <= 0:
+            return
+        # Preallocation is only a hint, so filesystems that don't support it (e.g. some network shares) are written as is
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                # SetEndOfFile on Windows allocates clusters for the new size without writing them
+                f.truncate(size)
+        except OSError:
+            pass
+        f.seek(0)
+
+    @staticmethod
+    def sync_dir(dir_path: Path):
+        # Folder handles can't be fsynced on Windows, NTFS journals metadata changes on its own there
+        try:
+            fd = os.open(dir_path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -1,10 +1,12 @@
 import requests
 
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass
 
 from dacite import from_dict
 
+from core.utils.cancellation import CancellationToken
+
 
 @dataclass
 class ResponseReleaseAsset:
@@ -57,21 +59,44 @@ class GitHubClient:
 
         raise ValueError(f"Failed to locate asset matching to '{asset_name_format}'!")
 
-    def download_data(self, url, block_size=4096, update_progress_callback=None):
-        response = requests.get(url, stream=True)
-
-        downloaded_bytes = 0
-        total_bytes = int(response.headers.get("content-length", 0))
-        if update_progress_callback is not None:
-            update_progress_callback(downloaded_bytes, total_bytes)
+    def fetch_content_length(self, url):
+        # Size is only used for preflight checks, so failed or unsupported HEAD request must not break the download
+        try:
+            response = requests.head(url, allow_redirects=True)
+            response.raise_for_status()
+            return int(response.headers.get('content-length', 0))
+        except Exception:
+            return 0
 
+    def download_data(self, url, block_size=4096, update_progress_callback=None, cancel_token: Optional[CancellationToken] = None):
         data = bytearray()
-        for block_data in response.iter_content(block_size):
-            data += block_data
-            downloaded_bytes += len(block_data)
-            if update_progress_callback is not None:
-                update_progress_callback(downloaded_bytes, total_bytes)
-
-        return data
-
-
+        total_bytes = 0
+        while True:
+            # Resumed download requests only bytes that weren't received yet
+            headers = {'Range': f'bytes={len(data)}-'} if data else {}
+            response = requests.get(url, stream=True, headers=headers)
+            if data and response.status_code != 206:
+                # Server doesn't support range requests, so download starts over
+                data = bytearray()
+            if not data:
+                total_bytes = int(response.headers.get("content-length", 0))
+                if update_progress_callback is not None:
+                    update_progress_callback(0, total_bytes)
+
+            paused = False
+            with response:
+                for block_data in response.iter_content(block_size):
+                    data += block_data
+                    if update_progress_callback is not None:
+                        update_progress_callback(len(data), total_bytes)
+                    if cancel_token is not None:
+                        cancel_token.check()
+                        if cancel_token.is_paused():
+                            paused = True
+                            break
+
+            if not paused:
+                return data
+
+            # Connection is dropped for the pause duration, it'd time out otherwise
+            cancel_token.wait_resumed()
@@ -0,0 +1,207 @@
+import os
+import mmap
+import struct
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+CFB_SIGNATURE = b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'
+END_OF_CHAIN = 0xFFFFFFFE
+FREE_SECT = 0xFFFFFFFF
+STREAM_ENTRY = 2
+
+# MSI compresses stream names by packing pairs of chars from this alphabet into a single UTF-16 code
+MSI_NAME_CHARSET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._'
+MSI_TABLE_PREFIX = 0x4840
+
+# Parsed properties keyed by (path, size, mtime), so unchanged files are never parsed twice
+_cache: Dict[Tuple[str, int, int], Dict[str, str]] = {}
+
+
+def get_product_version(file_path) -> str:
+    version = get_properties(file_path).get('ProductVersion', None)
+    if version is None:
+        raise ValueError(f'{Path(file_path).name} has no ProductVersion property!')
+    return version
+
+
+def get_properties(file_path) -> Dict[str, str]:
+    file_path = Path(file_path)
+    stat = os.stat(file_path)
+    cache_key = (str(file_path.absolute()), stat.st_size, stat.st_mtime_ns)
+    properties = _cache.get(cache_key, None)
+    if properties is None:
+        properties = read_properties(file_path)
+        _cache[cache_key] = properties
+    return properties
+
+
+def read_properties(file_path: Path) -> Dict[str, str]:
+    with open(file_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            raise ValueError(f'Failed to read {file_path.name} properties: file is empty!') from e
+        with data:
+            try:
+                return MSIReader(CompoundFile(data)).read_property_table()
+            except (struct.error, IndexError) as e:
+                raise ValueError(f'Failed to read {file_path.name} properties: file is truncated!') from e
+            except ValueError as e:
+                raise ValueError(f'Failed to read {file_path.name} properties: {e}') from e
+
+
+def decode_stream_name(name: str) -> str:
+    result = ''
+    for char in name:
+        code = ord(char)
+        if code == MSI_TABLE_PREFIX:
+            result += '!'
+        elif 0x3800 <= code < 0x4800:
+            code -= 0x3800
+            result += MSI_NAME_CHARSET[code & 0x3F] + MSI_NAME_CHARSET[(code >> 6) & 0x3F]
+        elif 0x4800 <= code < 0x4840:
+            result += MSI_NAME_CHARSET[code - 0x4800]
+        else:
+            result += char
+    return result
+
+
+class CompoundFile:
+    """
+    Minimal read-only OLE Compound File Binary parser, reads streams by name from flat directory list
+    """
+    def __init__(self, data):
+        self.data = data
+        if data[:8] != CFB_SIGNATURE:
+            raise ValueError('missing OLE compound file signature')
+
+        sector_shift, mini_sector_shift = struct.unpack_from('<HH', data, 0x1E)
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+
+        num_fat_sectors, first_dir_sector = struct.unpack_from('<II', data, 0x2C)
+        self.mini_stream_cutoff, first_mini_fat_sector, num_mini_fat_sectors = struct.unpack_from('<III', data, 0x38)
+        first_difat_sector, num_difat_sectors = struct.unpack_from('<II', data, 0x44)
+
+        self.fat = self.read_fat(num_fat_sectors, first_difat_sector, num_difat_sectors)
+        self.mini_fat = self.read_sector_table(self.read_chain(first_mini_fat_sector))
+
+        self.streams: Dict[str, Tuple[int, int]] = {}
+        directory = self.read_chain(first_dir_sector)
+        root_start, root_size = 0, 0
+        for offset in range(0, len(directory) - 127, 128):
+            name_length, entry_type = struct.unpack_from('<HB', directory, offset + 64)
+            start_sector, size = struct.unpack_from('<II', directory, offset + 116)
+            if entry_type == 5:
+                root_start, root_size = start_sector, size
+            elif entry_type == STREAM_ENTRY and name_length >= 2:
+                name = directory[offset:offset + name_length - 2].decode('utf-16-le')
+                self.streams[decode_stream_name(name)] = (start_sector, size)
+
+        self.mini_stream = self.read_chain(root_start)[:root_size] if root_size else b''
+
+    def read_sector(self, sector: int) -> bytes:
+        offset = (sector + 1) * self.sector_size
+        return self.data[offset:offset + self.sector_size]
+
+    def read_sector_table(self, data: bytes) -> List[int]:
+        return list(struct.unpack_from(f'<{len(data) // 4}I', data))
+
+    def read_fat(self, num_fat_sectors, first_difat_sector, num_difat_sectors) -> List[int]:
+        difat = list(struct.unpack_from('<109I', self.data, 0x4C))
+        sector = first_difat_sector
+        for i in range(num_difat_sectors):
+            if sector in (END_OF_CHAIN, FREE_SECT):
+                break
+            entries = self.read_sector_table(self.read_sector(sector))
+            difat += entries[:-1]
+            sector = entries[-1]
+        return self.read_sector_table(b''.join(self.read_sector(s) for s in difat[:num_fat_sectors]))
+
+    def read_chain(self, sector: int) -> bytes:
+        chunks = []
+        while sector not in (END_OF_CHAIN, FREE_SECT):
+            if len(chunks) > len(self.fat):
+                raise ValueError('sector chain loop detected')
+            chunks.append(self.read_sector(sector))
+            sector = self.fat[sector]
+        return b''.join(chunks)
+
+    def read_mini_chain(self, sector: int) -> bytes:
+        chunks = []
+        while sector not in (END_OF_CHAIN, FREE_SECT):
+            if len(chunks) > len(self.mini_fat):
+                raise ValueError('mini sector chain loop detected')
+            offset = sector * self.mini_sector_size
+            chunks.append(self.mini_stream[offset:offset + self.mini_sector_size])
+            sector = self.mini_fat[sector]
+        return b''.join(chunks)
+
+    def read_stream(self, name: str) -> bytes:
+        if name not in self.streams:
+            raise ValueError(f'missing {name} stream')
+        start_sector, size = self.streams[name]
+        if size < self.mini_stream_cutoff:
+            return self.read_mini_chain(start_sector)[:size]
+        return self.read_chain(start_sector)[:size]
+
+
+class MSIReader:
+    """
+    Reads MSI database tables stored in compound file streams, only string columns are supported
+    """
+    def __init__(self, compound_file: CompoundFile):
+        self.compound_file = compound_file
+        self.strings, self.string_ref_size = self.read_string_pool()
+
+    def read_string_pool(self) -> Tuple[List[str], int]:
+        pool = self.compound_file.read_stream('!_StringPool')
+        data = self.compound_file.read_stream('!_StringData')
+
+        codepage, = struct.unpack_from('<I', pool, 0)
+        # Databases with more than 64K strings flag 3-byte string references in the codepage high bit
+        string_ref_size = 3 if codepage & 0x80000000 else 2
+        encoding = f'cp{codepage & 0xFFFF}' if codepage & 0xFFFF else 'latin-1'
+
+        entries = struct.unpack_from(f'<{len(pool) // 2}H', pool)
+        # String id 0 is reserved for null value
+        strings = ['']
+        data_offset = 0
+        i = 2
+        while i + 1 < len(entries):
+            length, refs = entries[i], entries[i + 1]
+            if length == 0 and refs != 0:
+                # Long string: refcount is stored in this entry and 32-bit length in the next one
+                length = entries[i + 2] | (entries[i + 3] << 16)
+                i += 2
+            strings.append(self.decode_string(data[data_offset:data_offset + length], encoding))
+            data_offset += length
+            i += 2
+        return strings, string_ref_size
+
+    @staticmethod
+    def decode_string(data: bytes, encoding: str) -> str:
+        try:
+            return data.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            return data.decode('latin-1')
+
+    def read_string_table(self, name: str, num_columns: int) -> List[Tuple[str, ...]]:
+        data = self.compound_file.read_stream(f'!{name}')
+        row_size = self.string_ref_size * num_columns
+        num_rows = len(data) // row_size
+        # Tables are stored column by column
+        columns = []
+        for column in range(num_columns):
+            column_offset = column * num_rows * self.string_ref_size
+            values = []
+            for row in range(num_rows):
+                offset = column_offset + row * self.string_ref_size
+                string_id = int.from_bytes(data[offset:offset + self.string_ref_size], 'little')
+                values.append(self.strings[string_id])
+            columns.append(values)
+        return list(zip(*columns))
+
+    def read_property_table(self) -> Dict[str, str]:
+        return dict(self.read_string_table('Property', 2))
@@ -0,0 +1,129 @@
+import os
+import mmap
+import struct
+
+from pathlib import Path
+from typing import Dict, Tuple
+
+RT_VERSION = 16
+IMAGE_DIRECTORY_ENTRY_RESOURCE = 2
+VS_FIXEDFILEINFO_SIGNATURE = 0xFEEF04BD
+
+# Parsed versions keyed by (path, size, mtime), so unchanged files are never parsed twice
+_cache: Dict[Tuple[str, int, int], Tuple[int, int, int, int]] = {}
+
+
+def get_file_version(file_path, max_parts=4) -> str:
+    file_path = Path(file_path)
+    stat = os.stat(file_path)
+    cache_key = (str(file_path.absolute()), stat.st_size, stat.st_mtime_ns)
+    version = _cache.get(cache_key, None)
+    if version is None:
+        version = read_file_version(file_path)
+        _cache[cache_key] = version
+    return '.'.join(map(str, version[:max_parts]))
+
+
+def read_file_version(file_path: Path) -> Tuple[int, int, int, int]:
+    with open(file_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            raise ValueError(f'Failed to read version of {file_path.name}: file is empty!') from e
+        with data:
+            try:
+                return PEVersionReader(data).read_fixed_file_version()
+            except struct.error as e:
+                raise ValueError(f'Failed to read version of {file_path.name}: file is truncated!') from e
+            except ValueError as e:
+                raise ValueError(f'Failed to read version of {file_path.name}: {e}') from e
+
+
+class PEVersionReader:
+    """
+    Reads VS_FIXEDFILEINFO of PE file, walking only headers and resource tree path leading to RT_VERSION
+    """
+    def __init__(self, data):
+        self.data = data
+        self.sections = []
+        self.resource_rva = 0
+
+    def read_fixed_file_version(self) -> Tuple[int, int, int, int]:
+        self.parse_headers()
+        version_rva, version_size = self.find_version_resource()
+        offset = self.rva_to_offset(version_rva)
+        ms_file_version, ls_file_version = self.parse_version_info(offset, version_size)
+        return ms_file_version >> 16, ms_file_version & 0xFFFF, ls_file_version >> 16, ls_file_version & 0xFFFF
+
+    def parse_headers(self):
+        if self.data[:2] != b'MZ':
+            raise ValueError('missing DOS header')
+        (pe_offset,) = struct.unpack_from('<I', self.data, 0x3C)
+        if self.data[pe_offset:pe_offset+4] != b'PE\0\0':
+            raise ValueError('missing PE header')
+
+        coff_offset = pe_offset + 4
+        num_sections, = struct.unpack_from('<H', self.data, coff_offset + 2)
+        optional_header_size, = struct.unpack_from('<H', self.data, coff_offset + 16)
+
+        optional_offset = coff_offset + 20
+        magic, = struct.unpack_from('<H', self.data, optional_offset)
+        if magic == 0x10B:
+            data_dirs_offset = optional_offset + 96
+        elif magic == 0x20B:
+            data_dirs_offset = optional_offset + 112
+        else:
+            raise ValueError(f'unknown optional header magic {magic:#x}')
+        num_data_dirs, = struct.unpack_from('<I', self.data, data_dirs_offset - 4)
+        if num_data_dirs <= IMAGE_DIRECTORY_ENTRY_RESOURCE:
+            raise ValueError('no resource directory')
+        self.resource_rva, _ = struct.unpack_from('<II', self.data, data_dirs_offset + 8 * IMAGE_DIRECTORY_ENTRY_RESOURCE)
+        if self.resource_rva == 0:
+            raise ValueError('no resource directory')
+
+        sections_offset = optional_offset + optional_header_size
+        for i in range(num_sections):
+            virtual_size, virtual_address, raw_size, raw_offset = struct.unpack_from('<IIII', self.data, sections_offset + 40 * i + 8)
+            self.sections.append((virtual_address, max(virtual_size, raw_size), raw_offset))
+
+    def rva_to_offset(self, rva):
+        for virtual_address, size, raw_offset in self.sections:
+            if virtual_address <= rva < virtual_address + size:
+                return rva - virtual_address + raw_offset
+        raise ValueError(f'RVA {rva:#x} is outside of sections')
+
+    def find_version_resource(self) -> Tuple[int, int]:
+        root_offset = self.rva_to_offset(self.resource_rva)
+        # Resource tree levels: type -> name -> language, version resource is RT_VERSION type with any name and language
+        entry = self.find_directory_entry(root_offset, root_offset, RT_VERSION)
+        for level in range(2):
+            if not entry & 0x80000000:
+                raise ValueError('malformed resource directory')
+            entry = self.find_directory_entry(root_offset, root_offset + (entry & 0x7FFFFFFF))
+        if entry & 0x80000000:
+            raise ValueError('malformed resource directory')
+        data_rva, data_size = struct.unpack_from('<II', self.data, root_offset + entry)
+        return data_rva, data_size
+
+    def find_directory_entry(self, root_offset, directory_offset, entry_id=None):
+        num_named, num_ids = struct.unpack_from('<HH', self.data, directory_offset + 12)
+        entries_offset = directory_offset + 16
+        for i in range(num_named + num_ids):
+            name, offset = struct.unpack_from('<II', self.data, entries_offset + 8 * i)
+            if entry_id is None or (not name & 0x80000000 and name == entry_id):
+                return offset
+        raise ValueError('no version resource')
+
+    def parse_version_info(self, offset, size) -> Tuple[int, int]:
+        length, value_length, value_type = struct.unpack_from('<HHH', self.data, offset)
+        key = 'VS_VERSION_INFO\0'.encode('utf-16-le')
+        if self.data[offset+6:offset+6+len(key)] != key:
+            raise ValueError('malformed version resource')
+        if value_length == 0:
+            raise ValueError('version resource has no fixed file info')
+        # Value follows the key, aligned to 32-bit boundary
+        value_offset = offset + ((6 + len(key) + 3) & ~3)
+        signature, _, ms_file_version, ls_file_version = struct.unpack_from('<IIII', self.data, value_offset)
+        if signature != VS_FIXEDFILEINFO_SIGNATURE:
+            raise ValueError('invalid fixed file info signature')
+        return ms_file_version, ls_file_version
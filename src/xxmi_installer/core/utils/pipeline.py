@@ -0,0 +1,116 @@
+from typing import Callable, List, Iterable, Iterator, Tuple, Any, Optional
+from threading import Thread, Event
+from queue import Queue, Empty, Full
+
+
+class _End:
+    pass
+
+
+class _Error:
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
+class Pipeline:
+    """
+    Passes items through sequence of stages, every stage except the last one runs in its own thread
+    Stages are connected with bounded queues, so item N+1 is processed by stage K while item N is processed by stage K+1
+    Each stage is called as stage(item, previous_stage_result), items leave pipeline in the same order they entered it
+    Last stage runs in the caller thread, the first exception raised by any stage is re-raised there
+    If pipeline stops early, on_stop is called to let owner interrupt stage calls that are already running
+    """
+    def __init__(self, stages: List[Callable[[Any, Any], Any]], queue_size: int = 1, on_stop: Optional[Callable[[], None]] = None):
+        if len(stages) == 0:
+            raise ValueError('Pipeline requires at least one stage!')
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_stop = on_stop
+        self.stop_event: Optional[Event] = None
+
+    def run(self, items: Iterable) -> Iterator[Tuple[Any, Any]]:
+        # Every run gets its own event, so threads left from the previous run can't be resumed by clearing it
+        stop_event = self.stop_event = Event()
+
+        source = ((item, None) for item in items)
+        queues = []
+        for stage in self.stages[:-1]:
+            queue = Queue(maxsize=self.queue_size)
+            Thread(target=self.run_stage, args=(stage, source, queue, stop_event), daemon=True).start()
+            source = self.iter_queue(queue, stop_event)
+            queues.append(queue)
+
+        completed = False
+        try:
+            for item, value in source:
+                yield item, self.stages[-1](item, value)
+            completed = True
+        finally:
+            if not completed:
+                self.stop(stop_event)
+            # Free up space for stage threads that are blocked on full queues, so they notice the stop and exit
+            for queue in queues:
+                self.drain(queue)
+
+    def cancel(self):
+        if self.stop_event is not None:
+            self.stop(self.stop_event)
+
+    def stop(self, stop_event: Event):
+        if stop_event.is_set():
+            return
+        stop_event.set()
+        if self.on_stop is not None:
+            self.on_stop()
+
+    def run_stage(self, stage, source, queue: Queue, stop_event: Event):
+        try:
+            for item, value in source:
+                if stop_event.is_set():
+                    return
+                result = stage(item, value)
+                if stop_event.is_set():
+                    return
+                self.put(queue, (item, result), stop_event)
+        except Exception as e:
+            # Upstream stages stop right away instead of after the error reaches the caller
+            self.put(queue, _Error(e), stop_event, force=True)
+            self.stop(stop_event)
+            return
+        self.put(queue, _End(), stop_event)
+
+    @staticmethod
+    def put(queue: Queue, entry, stop_event: Event, force: bool = False):
+        while force or not stop_event.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return
+            except Full:
+                if force:
+                    # Error must reach the caller, so queued result that will never be used is replaced
+                    Pipeline.drain(queue)
+
+    @staticmethod
+    def drain(queue: Queue):
+        while True:
+            try:
+                queue.get_nowait()
+            except Empty:
+                return
+
+    @staticmethod
+    def iter_queue(queue: Queue, stop_event: Event):
+        while True:
+            try:
+                entry = queue.get(timeout=0.1)
+            except Empty:
+                if stop_event.is_set():
+                    return
+                continue
+            if isinstance(entry, _End):
+                return
+            if isinstance(entry, _Error):
+                raise entry.exception
+            if stop_event.is_set():
+                return
+            yield entry
@@ -1,15 +1,23 @@
+import os
+import sys
 import time
 import psutil
+import logging
+import selectors
 
-from typing import Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from enum import Enum
-from multiprocessing import Process, Value
+from dataclasses import dataclass, field
+from threading import Thread, Lock, Event, current_thread
+from concurrent.futures import Future
 
-import win32gui
-import win32process
+log = logging.getLogger(__name__)
 
 
 def get_hwnds_for_pid(pid):
+    import win32gui
+    import win32process
+
     def callback(hwnd, hwnds):
         #if win32gui.IsWindowVisible(hwnd) and win32gui.IsWindowEnabled(hwnd):
         _, found_pid = win32process.GetWindowThreadProcessId(hwnd)
@@ -39,95 +47,438 @@ class WaitResult(Enum):
     Terminated = -300
 
 
-def wait_for_process(process_name, timeout=10, with_window=False) -> Tuple[WaitResult, int]:
-    process = ProcessWaiter(process_name, timeout, with_window)
-    process.start()
-    process.join()
-    result = int(process.data.value)
+# Interval between process scans while there are processes to find
+SCAN_INTERVAL = 0.1
+# Time given to process to exit after graceful termination request before it's killed
+TERMINATE_TIMEOUT = 1
+
+
+class ProcessScanner:
     """
-    Possible returns:
-    0...MAX_PID: exit before timeout with process found
-    -200: timeout reached
+    Keeps names of running processes between scans, so only processes started since the previous scan are queried
+    Names are cached by (pid, create_time), as pid of exited process may be reused by another one
     """
+    def __init__(self):
+        self.create_times: Dict[int, float] = {}
+        self.names: Dict[Tuple[int, float], Optional[str]] = {}
+        self.pids_by_name: Dict[Optional[str], Set[int]] = {}
+
+    def scan(self, tracked_names: Set[str]) -> Dict[Optional[str], Set[int]]:
+        pids = set(psutil.pids())
+        for pid in self.create_times.keys() - pids:
+            self.drop(pid)
+        for pid in pids - self.create_times.keys():
+            self.add(pid)
+        # Pid of tracked process could be reused between scans, and exited child process stays listed until it's reaped
+        for name in tracked_names:
+            for pid in list(self.pids_by_name.get(name, ())):
+                self.verify(pid)
+        return self.pids_by_name
 
-    if result < 0:
-        return WaitResult(result), -1
-    else:
-        return WaitResult.Found, result
+    def add(self, pid: int):
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                create_time = process.create_time()
+                try:
+                    name = process.name()
+                except psutil.AccessDenied:
+                    # Process is still cached, so access to it isn't requested again on every scan
+                    name = None
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return
+        self.create_times[pid] = create_time
+        self.names[(pid, create_time)] = name
+        self.pids_by_name.setdefault(name, set()).add(pid)
 
+    def drop(self, pid: int):
+        create_time = self.create_times.pop(pid)
+        name = self.names.pop((pid, create_time))
+        pids = self.pids_by_name[name]
+        pids.discard(pid)
+        if not pids:
+            del self.pids_by_name[name]
 
-def wait_for_process_exit(process_name, timeout=10, kill_timeout=-1) -> Tuple[WaitResult, int]:
-    process = ProcessWaiter(process_name, timeout, wait_exit=True, kill_timeout=kill_timeout)
-    process.start()
-    process.join()
-    result = int(process.data.value)
+    def verify(self, pid: int):
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                if process.status() == psutil.STATUS_ZOMBIE:
+                    self.drop(pid)
+                    return
+                if process.create_time() == self.create_times[pid]:
+                    return
+        except psutil.NoSuchProcess:
+            self.drop(pid)
+            return
+        except psutil.AccessDenied:
+            return
+        self.drop(pid)
+        self.add(pid)
+
+
+def is_process_exited(pid: int) -> bool:
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+    except psutil.Error:
+        # Process is running, but its status can't be read
+        return False
+
+
+class PolledPids:
     """
-    Possible returns:
-    0...MAX_PID: process exit before timeout
-    -100: exit before timeout with process not found
-    -200: timeout reached with process alive
-    -300: process terminated after kill_timeout
+    Pids that OS doesn't let to wait for, they're checked every SCAN_INTERVAL instead
+    """
+    def __init__(self):
+        self.pids: Set[int] = set()
+
+    def get_timeout(self, timeout: Optional[float]) -> Optional[float]:
+        if not self.pids:
+            return timeout
+        return SCAN_INTERVAL if timeout is None else min(timeout, SCAN_INTERVAL)
+
+    def pop_exited(self) -> Set[int]:
+        exited = {pid for pid in self.pids if is_process_exited(pid)}
+        self.pids -= exited
+        return exited
+
+
+class PidfdExitNotifier:
     """
+    Waits for exit of watched processes via pidfd, which becomes readable once process exits (Linux 5.3+)
+    """
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ, None)
+        self.fds: Dict[int, int] = {}
+        self.exited: Set[int] = set()
+        self.polled = PolledPids()
+
+    def sync(self, pids: Set[int]):
+        for pid in self.fds.keys() - pids:
+            self.unwatch(pid)
+        self.exited &= pids
+        self.polled.pids &= pids
+        for pid in pids - self.fds.keys() - self.exited - self.polled.pids:
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                self.exited.add(pid)
+                continue
+            except OSError:
+                self.polled.pids.add(pid)
+                continue
+            self.fds[pid] = fd
+            self.selector.register(fd, selectors.EVENT_READ, pid)
+
+    def unwatch(self, pid: int):
+        fd = self.fds.pop(pid)
+        self.selector.unregister(fd)
+        os.close(fd)
+
+    def wait(self, timeout: Optional[float]) -> Set[int]:
+        exited, self.exited = self.exited, set()
+        for key, _ in self.selector.select(0 if exited else self.polled.get_timeout(timeout)):
+            if key.data is None:
+                try:
+                    while os.read(self.wake_read, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                exited.add(key.data)
+                self.unwatch(key.data)
+        return exited | self.polled.pop_exited()
 
-    if result < 0:
-        return WaitResult(result), -1
-    else:
-        return WaitResult.Found, result
+    def wake(self):
+        try:
+            os.write(self.wake_write, b'\0')
+        except BlockingIOError:
+            # Pipe is full of wake ups already
+            pass
 
 
-class ProcessWaiter(Process):
+class HandleExitNotifier:
     """
-    Waits for process spawn or exit
-    Possible self.data.value returns:
-    0...MAX_PID: exit before timeout with process found
-    -100: exit before timeout with process not found
-    -200: timeout reached
-    -300: process terminated after kill_timeout
+    Waits for exit of watched processes via their handles, which are signaled once process exits (Windows)
     """
-    def __init__(self, process_name, timeout=-1, with_window=False, wait_exit=False, kill_timeout=-1):
-        Process.__init__(self)
-        self.process_name = process_name
-        self.timeout = int(timeout)
-        self.with_window = with_window
-        self.wait_exit = wait_exit
-        self.kill_timeout = kill_timeout
-        self.data = Value('i', -100)
+    def __init__(self):
+        import win32event
+        self.wake_event = win32event.CreateEvent(None, False, False, None)
+        self.handles: Dict[int, object] = {}
+        self.polled = PolledPids()
 
-    def run(self):
+    def sync(self, pids: Set[int]):
+        import win32api
+        import win32con
+        for pid in self.handles.keys() - pids:
+            win32api.CloseHandle(self.handles.pop(pid))
+        self.polled.pids &= pids
+        for pid in pids - self.handles.keys() - self.polled.pids:
+            try:
+                self.handles[pid] = win32api.OpenProcess(win32con.SYNCHRONIZE, False, pid)
+            except Exception:
+                # Access to process is denied (e.g. it's elevated) or it's already gone
+                self.polled.pids.add(pid)
+
+    def wait(self, timeout: Optional[float]) -> Set[int]:
+        import win32api
+        import win32event
+        exited = set()
+        timeout = self.polled.get_timeout(timeout)
+        pids = list(self.handles.keys())
+        # Only the first signaled handle is reported, others are picked up by the next immediate wait
+        result = win32event.WaitForMultipleObjects([self.wake_event] + [self.handles[pid] for pid in pids], False,
+                                                   win32event.INFINITE if timeout is None else int(timeout * 1000))
+        index = result - win32event.WAIT_OBJECT_0
+        if 0 < index <= len(pids):
+            pid = pids[index - 1]
+            win32api.CloseHandle(self.handles.pop(pid))
+            exited.add(pid)
+        return exited | self.polled.pop_exited()
+
+    def wake(self):
+        import win32event
+        win32event.SetEvent(self.wake_event)
+
+
+class PollingExitNotifier:
+    """
+    Checks watched processes every SCAN_INTERVAL, used when OS provides no way to wait for exit of unrelated process
+    """
+    def __init__(self):
+        self.polled = PolledPids()
+        self.wake_event = Event()
+
+    def sync(self, pids: Set[int]):
+        self.polled.pids = set(pids)
+
+    def wait(self, timeout: Optional[float]) -> Set[int]:
+        self.wake_event.wait(SCAN_INTERVAL if timeout is None else min(timeout, SCAN_INTERVAL))
+        self.wake_event.clear()
+        return self.polled.pop_exited()
+
+    def wake(self):
+        self.wake_event.set()
+
+
+def create_exit_notifier():
+    if sys.platform == 'win32':
+        try:
+            return HandleExitNotifier()
+        except ImportError:
+            pass
+    elif hasattr(os, 'pidfd_open'):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+            return PidfdExitNotifier()
+        except OSError:
+            # Kernel doesn't support pidfd
+            pass
+    return PollingExitNotifier()
+
+
+@dataclass
+class ProcessWait:
+    process_name: str
+    deadline: float
+    with_window: bool = False
+    wait_exit: bool = False
+    kill_deadline: float = float('inf')
+    pid: int = -1
+    killed: bool = False
+    future: Future = field(default_factory=Future)
+
+
+class ProcessWatcher:
+    """
+    Serves every process wait of the application from single background thread
+    Processes are scanned only while there are ones to find, exit of found processes is reported by OS
+    Thread is started on the first wait and exits once there are no waits left
+    """
+    def __init__(self):
+        self.waits: List[ProcessWait] = []
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+        self.has_new_waits = False
+        self.scanner = ProcessScanner()
+        self.notifier = None
 
-        time_start = time.time()
+    def watch(self, wait: ProcessWait) -> Future:
+        with self.lock:
+            self.waits.append(wait)
+            self.has_new_waits = True
+            if self.notifier is None:
+                self.notifier = create_exit_notifier()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+        # New wait is checked right away instead of the next tick
+        self.notifier.wake()
+        return wait.future
 
+    def stop(self):
+        """
+        Interrupts every registered wait, threads blocked on them get InterruptedError
+        """
+        with self.lock:
+            waits, self.waits = self.waits, []
+            thread = self.thread
+        for wait in waits:
+            wait.future.set_exception(InterruptedError('Operation canceled!'))
+        if thread is not None:
+            self.notifier.wake()
+
+    def join(self, timeout: float) -> bool:
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def run(self):
+        try:
+            self.watch_processes()
+        except Exception as e:
+            log.exception(f'Process watcher failed: {e}')
+            # Waiting threads must not hang on watcher that's gone
+            with self.lock:
+                waits, self.waits = self.waits, []
+            for wait in waits:
+                self.complete(wait, error=e)
+        finally:
+            with self.lock:
+                if self.thread is current_thread():
+                    self.thread = None
+
+    def watch_processes(self):
+        exited = set()
         while True:
+            with self.lock:
+                waits = list(self.waits)
+                has_new_waits, self.has_new_waits = self.has_new_waits, False
+            snapshot = None
+            # Exited process may be not the last one with the same name, so it's followed by scan as well
+            if has_new_waits or exited or any(not wait.wait_exit for wait in waits):
+                snapshot = self.scanner.scan({wait.process_name for wait in waits})
+            now = time.time()
+            for wait in waits:
+                try:
+                    result = self.check_wait(wait, snapshot, now)
+                except Exception as e:
+                    self.complete(wait, error=e)
+                    continue
+                if result is not None:
+                    self.complete(wait, result=result)
+            with self.lock:
+                if not self.waits:
+                    # Thread is released under the same lock, so new wait either gets checked here or starts new thread
+                    self.notifier.sync(set())
+                    self.thread = None
+                    return
+                self.notifier.sync({wait.pid for wait in self.waits if wait.wait_exit and wait.pid != -1})
+                timeout = self.get_timeout(self.waits)
+            exited = self.notifier.wait(timeout)
+
+    def complete(self, wait: ProcessWait, result: Optional[Tuple[WaitResult, int]] = None, error: Optional[Exception] = None):
+        with self.lock:
+            if wait in self.waits:
+                self.waits.remove(wait)
+        # Wait may be already interrupted by stop()
+        if wait.future.done():
+            return
+        if error is not None:
+            wait.future.set_exception(error)
+        else:
+            wait.future.set_result(result)
+
+    @staticmethod
+    def get_timeout(waits: List[ProcessWait]) -> Optional[float]:
+        deadline = float('inf')
+        for wait in waits:
+            deadline = min(deadline, wait.deadline, wait.kill_deadline)
+            if not wait.wait_exit:
+                deadline = min(deadline, time.time() + SCAN_INTERVAL)
+        if deadline == float('inf'):
+            return None
+        return max(0.0, deadline - time.time())
 
-            current_time = time.time()
+    @staticmethod
+    def check_wait(wait: ProcessWait, snapshot: Optional[Dict[Optional[str], Set[int]]], now: float) -> Optional[Tuple[WaitResult, int]]:
+        if snapshot is not None:
+            pids = snapshot.get(wait.process_name, None)
+        else:
+            # Found process is known to be running until its exit is reported
+            pids = {wait.pid}
+        if pids:
+            # Process is found
+            wait.pid = wait.pid if wait.pid in pids else min(pids)
+            if not wait.wait_exit:
+                # Process is found and waiting for window is either not required or window is also found
+                if not wait.with_window or len(get_hwnds_for_pid(wait.pid)) != 0:
+                    return WaitResult.Found, wait.pid
+            elif now >= wait.kill_deadline:
+                # Process is asked to exit once kill_timeout is reached, and killed if it's still running after TERMINATE_TIMEOUT
+                force = wait.killed
+                wait.killed = True
+                wait.kill_deadline = now + TERMINATE_TIMEOUT
+                for pid in pids:
+                    try:
+                        if force:
+                            psutil.Process(pid).kill()
+                        else:
+                            psutil.Process(pid).terminate()
+                    except (psutil.NoSuchProcess, psutil.AccessDenied):
+                        pass
+        elif wait.wait_exit:
+            if wait.killed:
+                return WaitResult.Terminated, -1
+            if wait.pid == -1:
+                return WaitResult.NotFound, -1
+            return WaitResult.Found, wait.pid
+        if now >= wait.deadline:
+            return WaitResult.Timeout, -1
+        return None
 
-            if self.timeout != -1 and current_time - time_start >= self.timeout:
-                break
 
-            process = get_process(process_name=self.process_name)
+watcher = ProcessWatcher()
 
-            if process is not None:
-                # Process is found
-                self.data.value = process.pid
 
-                if not self.wait_exit:
-                    # We're in wait-for-process-spawn mode
-                    if not self.with_window:
-                        # Exit loop: process is found and waiting for window is not required
-                        return
-                    elif len(get_hwnds_for_pid(self.data.value)) != 0:
-                        # Exit loop: process is found and window is also found
-                        return
+def get_deadline(start_time: float, timeout: float) -> float:
+    return float('inf') if timeout == -1 else start_time + timeout
 
-                # Start process termination attempts once kill_timeout is reached
-                if self.kill_timeout != -1 and current_time - time_start >= self.kill_timeout:
-                    self.data.value = -300
-                    process.kill()
 
-            elif self.wait_exit:
-                return
+def wait_for_process(process_name, timeout=10, with_window=False) -> Tuple[WaitResult, int]:
+    """
+    Possible returns:
+    Found, pid: process is found before timeout
+    Timeout, -1: timeout reached
+    """
+    start_time = time.time()
+    return watcher.watch(ProcessWait(
+        process_name=process_name,
+        deadline=get_deadline(start_time, timeout),
+        with_window=with_window,
+    )).result()
 
-            time.sleep(0.1)
 
-        # Timeout reached, lets signal it with -200 return code
-        self.data.value = -200
+def wait_for_process_exit(process_name, timeout=10, kill_timeout=-1) -> Tuple[WaitResult, int]:
+    """
+    Possible returns:
+    Found, pid: process exit before timeout
+    NotFound, -1: process is not running
+    Timeout, -1: timeout reached with process alive
+    Terminated, -1: process terminated after kill_timeout
+    """
+    start_time = time.time()
+    return watcher.watch(ProcessWait(
+        process_name=process_name,
+        deadline=get_deadline(start_time, timeout),
+        wait_exit=True,
+        kill_deadline=get_deadline(start_time, kill_timeout),
+    )).result()
@@ -0,0 +1,59 @@
+import time
+import logging
+
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class StopHook:
+    name: str
+    # Signals component to stop by given time.monotonic() deadline, must not block
+    stop: Callable[[float], None]
+    # Blocks until component is stopped or timeout is reached, returns False on timeout
+    wait: Callable[[float], bool]
+    # Called only if component didn't stop by deadline
+    escalate: Optional[Callable[[], None]] = None
+
+
+class ShutdownCoordinator:
+    """
+    Signals every registered component to stop at once and waits for them until shared deadline
+    Exit takes as long as the slowest component needs, only components that are late get escalated
+    """
+    def __init__(self):
+        self.hooks: List[StopHook] = []
+
+    def register(self, hook: StopHook):
+        self.hooks.append(hook)
+
+    def shutdown(self, timeout: float) -> List[str]:
+        """
+        Returns names of components that failed to stop in time
+        """
+        deadline = time.monotonic() + timeout
+        for hook in self.hooks:
+            try:
+                hook.stop(deadline)
+            except Exception as e:
+                log.exception(f'Failed to stop {hook.name}: {e}')
+        late_hooks = []
+        for hook in self.hooks:
+            try:
+                stopped = hook.wait(max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                log.exception(f'Failed to wait for {hook.name}: {e}')
+                stopped = False
+            if stopped:
+                log.debug(f'Stopped {hook.name}')
+                continue
+            log.error(f'Failed to stop {hook.name} in {timeout} seconds!')
+            late_hooks.append(hook.name)
+            if hook.escalate is not None:
+                try:
+                    hook.escalate()
+                except Exception as e:
+                    log.exception(f'Failed to escalate stop of {hook.name}: {e}')
+        return late_hooks
@@ -0,0 +1,79 @@
+import sys
+import time
+import itertools
+import traceback
+
+from enum import IntEnum
+from threading import Thread
+from queue import PriorityQueue
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+
+class Priority(IntEnum):
+    User = 0
+    Background = 10
+
+
+# Shutdown sentinel goes after every pending task regardless of its priority
+SHUTDOWN_PRIORITY = float('inf')
+
+
+class TaskExecutor:
+    """
+    Runs tasks on fixed amount of worker threads, tasks with higher priority are taken from the queue first
+    Completion callbacks are passed to dispatch function, so they can be executed on thread of caller's choice
+    """
+    def __init__(self, max_workers: int = 2, dispatch: Optional[Callable] = None):
+        self.queue = PriorityQueue()
+        self.counter = itertools.count()
+        self.dispatch = dispatch
+        self.workers = [Thread(target=self.run_worker, daemon=True) for _ in range(max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, callback, *args, priority: Priority = Priority.Background, on_done: Optional[Callable] = None, **kwargs) -> Future:
+        future = Future()
+        if on_done is not None:
+            if self.dispatch is not None:
+                future.add_done_callback(lambda done_future: self.dispatch(on_done, done_future))
+            else:
+                future.add_done_callback(on_done)
+        # Counter keeps FIFO order within the same priority and prevents comparison of other tuple fields
+        self.queue.put((priority, next(self.counter), future, callback, args, kwargs))
+        return future
+
+    def run_worker(self):
+        while True:
+            priority, _, future, callback, args, kwargs = self.queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = callback(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True):
+        for _ in self.workers:
+            self.queue.put((SHUTDOWN_PRIORITY, next(self.counter), None, None, None, None))
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+    def join(self, timeout: float) -> bool:
+        """
+        Waits for workers to finish after shutdown, returns False if some of them are still running after timeout
+        """
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        return not any(worker.is_alive() for worker in self.workers)
+
+    def get_stuck_traces(self) -> List[str]:
+        frames = sys._current_frames()
+        return [''.join(traceback.format_stack(frames[worker.ident]))
+                for worker in self.workers if worker.is_alive() and worker.ident in frames]
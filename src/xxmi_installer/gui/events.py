@@ -16,7 +16,7 @@ class GUIEvents:
     @dataclass
     class InstallerFrame:
 
-        @dataclass
+        @dataclass(slots=True)
         class StageUpdate:
             stage: Stage
 
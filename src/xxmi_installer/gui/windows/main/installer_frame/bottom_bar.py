@@ -163,15 +163,30 @@ class RightStatusText(UIText):
         self.subscribe(
             Events.PackageManager.UpdateDownloadProgress,
             lambda event: self.update_progress(event.downloaded_bytes, event.total_bytes))
+        self.subscribe(
+            Events.PackageManager.InitializeDownload,
+            lambda event: self.reset_pause())
+        # Download can be paused and resumed by clicking its progress
+        self.paused = False
+        self.bind('<ButtonPress-1>', self.handle_button_press)
+
+    def reset_pause(self):
+        # Paused state must not outlive the download it was set for
+        if self.paused:
+            self.paused = False
+            Events.Fire(Events.PackageManager.ResumeDownload())
+
+    def handle_button_press(self, event):
+        self.paused = not self.paused
+        if self.paused:
+            Events.Fire(Events.PackageManager.PauseDownload())
+            self.set('Paused (click to resume)')
+        else:
+            Events.Fire(Events.PackageManager.ResumeDownload())
 
     def update_progress(self, downloaded_bytes, total_bytes):
+        if self.paused:
+            return
         progress = downloaded_bytes / total_bytes
-        progress_text = '%.2f%% (%s/%s)' % (progress * 100, self.format_size(downloaded_bytes), self.format_size(total_bytes))
+        progress_text = '%.2f%% (%s/%s)' % (progress * 100, Paths.format_size(downloaded_bytes), Paths.format_size(total_bytes))
         self.set(progress_text)
-
-    @staticmethod
-    def format_size(num_bytes):
-        units = ('B', 'KB', 'MB', 'GB', 'TB')
-        for power, unit in enumerate(units):
-            if num_bytes < 1024 ** (power + 1):
-                return '%.2f%s' % (num_bytes / 1024 ** power, unit)